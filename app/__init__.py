@@ -4,6 +4,7 @@ from datetime import date, datetime, timezone
 from zoneinfo import ZoneInfo
 
 from flask import Flask, send_from_directory
+from jinja2 import FileSystemBytecodeCache
 
 from .extensions import db, login_manager, migrate
 from .main import main_bp
@@ -65,10 +66,17 @@ def create_app() -> Flask:
             return v.strftime("%d/%m/%Y")
         return str(v)
 
+    # Templates compilados ficam em disco: cada worker reaproveita o bytecode em vez de recompilar
+    # recibos/telas na primeira renderização após subir.
+    jinja_cache_dir = os.path.join(app.instance_path, "jinja_cache")
+    os.makedirs(jinja_cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
+
     media_guides_dir = os.path.join(app.instance_path, "media", "guides")
     os.makedirs(media_guides_dir, exist_ok=True)
     media_esocial_dir = os.path.join(app.instance_path, "media", "esocial")
     os.makedirs(media_esocial_dir, exist_ok=True)
+    os.makedirs(os.path.join(app.instance_path, "compliance_results"), exist_ok=True)
 
     @app.route("/media/guides/<path:filename>")
     def media_guides(filename: str):
@@ -1,23 +1,16 @@
 from datetime import date, datetime, timedelta
-from decimal import Decimal
 
 from flask import Blueprint, render_template, request, session, url_for
 from flask_login import login_required, current_user
 
 from .extensions import db
 from .models import (
-    CompetenceClose,
-    EmployeeLeave,
-    EmployeeTermination,
-    EmployeeThirteenth,
-    EmployeeVacation,
     GuideDocument,
-    PayrollRun,
-    RevenueNote,
     TaxInssBracket,
     TaxIrrfBracket,
     TaxIrrfConfig,
 )
+from .payroll import _calc_all_month_summaries
 
 
 main_bp = Blueprint("main", __name__)
@@ -303,8 +296,9 @@ def index():
         month = now.month
 
     comp = _competence_start(year, month)
-    run = PayrollRun.query.filter_by(year=year, month=month).first()
-    revenue_count = RevenueNote.query.filter_by(year=year, month=month).count()
+    summaries = _calc_all_month_summaries(year, month)
+    presence = summaries["presence"]
+    revenue_count = summaries["revenue"]["count"]
 
     inss_eff = _latest_inss_effective(comp)
     irrf_eff = _latest_irrf_effective(comp)
@@ -314,11 +308,13 @@ def index():
         .first()
     )
 
-    docs = {
-        "darf": GuideDocument.query.filter_by(year=year, month=month, doc_type="darf").first(),
-        "das": GuideDocument.query.filter_by(year=year, month=month, doc_type="das").first(),
-        "fgts": GuideDocument.query.filter_by(year=year, month=month, doc_type="fgts").first(),
-    }
+    docs = {"darf": None, "das": None, "fgts": None}
+    for doc in GuideDocument.query.filter(
+        GuideDocument.year == year,
+        GuideDocument.month == month,
+        GuideDocument.doc_type.in_(tuple(docs)),
+    ).all():
+        docs[doc.doc_type] = doc
     home_obligations = _build_home_obligations(year=year, month=month, docs=docs)
     overdue_items = [it for it in home_obligations if it.get("bucket") == "overdue"]
     today_items = [it for it in home_obligations if it.get("bucket") == "today"]
@@ -338,26 +334,12 @@ def index():
         "last_compliance": last_compliance,
     }
 
-    # Vacations summary for the month
-    vac_rows = EmployeeVacation.query.filter_by(year=year, month=month).all()
-    vac_count = len(vac_rows)
-    vac_total = sum([Decimal(str(r.gross_total or 0)) for r in vac_rows], Decimal("0")).quantize(Decimal("0.01"))
-
-    # 13th salary summary for the month
-    thirteenth_rows = EmployeeThirteenth.query.filter_by(payment_year=year, payment_month=month).all()
-    thirteenth_count = len(thirteenth_rows)
-    thirteenth_total = sum([Decimal(str(r.gross_amount or 0)) for r in thirteenth_rows], Decimal("0")).quantize(Decimal("0.01"))
-
-    # Terminations summary for the month
-    termination_rows = EmployeeTermination.query.filter_by(year=year, month=month).all()
-    termination_count = len(termination_rows)
-    termination_total = sum([Decimal(str(r.gross_total or 0)) for r in termination_rows], Decimal("0")).quantize(Decimal("0.01"))
-
-    # Leaves summary for the month
-    leave_rows = EmployeeLeave.query.filter_by(year=year, month=month).all()
-    leave_count = len(leave_rows)
-
-    closed = CompetenceClose.query.filter_by(year=year, month=month).first()
+    # Vacations / 13th / terminations / leaves summaries for the month (one SELECT, shared with the monthly guide)
+    vac_count, vac_total = summaries["vacations"]["count"], summaries["vacations"]["total_gross"]
+    thirteenth_count, thirteenth_total = summaries["thirteenth"]["count"], summaries["thirteenth"]["total_gross"]
+    termination_count, termination_total = summaries["terminations"]["count"], summaries["terminations"]["total_gross"]
+    leave_count = summaries["leaves"]["count"]
+    closed = presence["closed"]
 
     status = {
         "competence": {
@@ -372,7 +354,7 @@ def index():
             "action_label": "Abrir Receitas",
         },
         "payroll": {
-            "ok": bool(run),
+            "ok": presence["run"],
             "action_url": url_for("payroll.payroll_home", year=year, month=month),
             "action_label": "Abrir Folha",
         },
@@ -3,6 +3,7 @@ from __future__ import annotations
 from datetime import date, datetime
 
 from flask_login import UserMixin
+from sqlalchemy import event
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from .extensions import db, login_manager
@@ -62,6 +63,8 @@ class Employee(db.Model):
     role_title = db.Column(db.String(120), nullable=True)
     pis = db.Column(db.String(20), nullable=True)
     active = db.Column(db.Boolean, default=True, nullable=False)
+    # Contador desnormalizado de dependentes (mantido pelos eventos de EmployeeDependent abaixo).
+    dependents_count = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     salaries = db.relationship(
@@ -72,6 +75,11 @@ class Employee(db.Model):
         lazy=True,
     )
 
+    __table_args__ = (
+        db.Index("ix_employee_cpf", "cpf"),
+        db.Index("ix_employee_pis", "pis"),
+    )
+
 
 class EmployeeDependent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -81,6 +89,25 @@ class EmployeeDependent(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
 
+def _bump_dependents_count(connection, employee_id: int, delta: int) -> None:
+    employee_table = Employee.__table__
+    connection.execute(
+        employee_table.update()
+        .where(employee_table.c.id == employee_id)
+        .values(dependents_count=employee_table.c.dependents_count + delta)
+    )
+
+
+@event.listens_for(EmployeeDependent, "after_insert")
+def _dependent_after_insert(mapper, connection, target) -> None:
+    _bump_dependents_count(connection, target.employee_id, 1)
+
+
+@event.listens_for(EmployeeDependent, "after_delete")
+def _dependent_after_delete(mapper, connection, target) -> None:
+    _bump_dependents_count(connection, target.employee_id, -1)
+
+
 class EmployeeSalary(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey("employee.id"), nullable=False, index=True)
@@ -104,6 +131,20 @@ class PayrollRun(db.Model):
         cascade="all, delete-orphan",
         lazy=True,
     )
+    # Somente leitura: guias e fechamento compartilham a chave natural (year, month) com a folha.
+    guide_documents = db.relationship(
+        "GuideDocument",
+        primaryjoin="and_(PayrollRun.year == foreign(GuideDocument.year), PayrollRun.month == foreign(GuideDocument.month))",
+        viewonly=True,
+        lazy=True,
+    )
+    competence_close = db.relationship(
+        "CompetenceClose",
+        primaryjoin="and_(PayrollRun.year == foreign(CompetenceClose.year), PayrollRun.month == foreign(CompetenceClose.month))",
+        viewonly=True,
+        uselist=False,
+        lazy=True,
+    )
 
     __table_args__ = (db.UniqueConstraint("year", "month", name="uq_payroll_run_year_month"),)
 
@@ -180,7 +221,8 @@ class RevenueNote(db.Model):
     amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    __table_args__ = (db.Index("ix_revenue_note_year_month", "year", "month"),)
+    # (year, month, issued_at) serve tanto o filtro da competência quanto a ordenação da lista de receitas.
+    __table_args__ = (db.Index("ix_revenue_note_year_month_issued", "year", "month", "issued_at"),)
 
 
 class EmployeeVacation(db.Model):
@@ -210,6 +252,11 @@ class EmployeeVacation(db.Model):
     inss_est = db.Column(db.Numeric(12, 2), nullable=True)
     irrf_est = db.Column(db.Numeric(12, 2), nullable=True)
     net_est = db.Column(db.Numeric(12, 2), nullable=True)
+    # Effective dates of the INSS/IRRF tables used for the estimates (detects stale estimates)
+    inss_table_from = db.Column(db.Date, nullable=True)
+    irrf_table_from = db.Column(db.Date, nullable=True)
+    # SHA-256 of the INSS/IRRF table contents used (in-place table edits keep the dates but change this)
+    tax_tables_digest = db.Column(db.String(64), nullable=True)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
@@ -217,6 +264,7 @@ class EmployeeVacation(db.Model):
 
     __table_args__ = (
         db.Index("ix_employee_vacation_year_month", "year", "month"),
+        db.Index("ix_employee_vacation_employee_year_month", "employee_id", "year", "month"),
     )
 
 
@@ -260,6 +308,13 @@ class EmployeeThirteenth(db.Model):
     __table_args__ = (
         db.Index("ix_employee_thirteenth_ref_year", "reference_year"),
         db.Index("ix_employee_thirteenth_payment", "payment_year", "payment_month"),
+        db.Index(
+            "ix_employee_thirteenth_employee_ref_payment",
+            "employee_id",
+            "reference_year",
+            "payment_year",
+            "payment_month",
+        ),
     )
 
 
@@ -294,6 +349,7 @@ class EmployeeTermination(db.Model):
 
     __table_args__ = (
         db.Index("ix_employee_termination_year_month", "year", "month"),
+        db.Index("ix_employee_termination_employee_date", "employee_id", "termination_date"),
     )
 
 
@@ -319,6 +375,7 @@ class EmployeeLeave(db.Model):
 
     __table_args__ = (
         db.Index("ix_employee_leave_year_month", "year", "month"),
+        db.Index("ix_employee_leave_employee_start", "employee_id", "start_date"),
     )
 
 
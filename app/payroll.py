@@ -1,18 +1,32 @@
 from __future__ import annotations
 
+import hashlib
 import os
 import json
+import random
 import re
+import shutil
+import tempfile
+import time
+from bisect import bisect_right
+from collections import Counter, namedtuple
 from datetime import date, datetime, timedelta
-from decimal import Decimal, InvalidOperation
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
 from urllib.parse import urlparse
 from xml.sax.saxutils import escape as xml_escape
 
 import requests
 from bs4 import BeautifulSoup
-from flask import Blueprint, current_app, flash, jsonify, redirect, render_template, request, session, url_for
+from flask import Blueprint, abort, current_app, flash, g, jsonify, redirect, render_template, request, session, url_for
 from flask_login import current_user, login_required
 from lxml import etree
+from markupsafe import Markup
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, load_only, selectinload
 from werkzeug.utils import secure_filename
 
 from .extensions import db
@@ -41,8 +55,37 @@ from .tax_sync import run_compliance_check, run_tax_sync
 
 payroll_bp = Blueprint("payroll", __name__, url_prefix="/payroll")
 
-
-TUTORIALS: dict[str, dict] = {
+# Constantes Decimal usadas nos cálculos (evita reconstruir Decimal a partir de string a cada chamada).
+_ZERO = Decimal("0")
+_CENT = Decimal("0.01")
+_ONE = Decimal("1")
+_FIVE = Decimal("5")
+_TWELVE = Decimal("12")
+_THIRTY = Decimal("30")
+_HUNDRED = Decimal("100")
+_DEFAULT_WEEKLY_HOURS = Decimal("44")
+_DEFAULT_OVERTIME_PCT = Decimal("50")
+_DAILY_PLACES = Decimal("0.0001")
+
+_VALID_TERMINATION_TYPES = frozenset({"without_cause", "with_cause", "agreement", "resignation"})
+_VALID_NOTICE_TYPES = frozenset({"worked", "indemnified", "none"})
+_VALID_LEAVE_TYPES = frozenset({"medical", "maternity", "accident", "unpaid", "other"})
+_VALID_LEAVE_PAID_BY = frozenset({"company", "inss", "mixed"})
+_VALID_THIRTEENTH_PAYMENT_TYPES = frozenset({"1st_installment", "2nd_installment", "full"})
+_THIRTEENTH_DISCOUNT_PAYMENT_TYPES = frozenset({"2nd_installment", "full"})
+_GUIDE_DOC_TYPES_ORDER = ("darf", "das", "fgts")
+_VALID_GUIDE_DOC_TYPES = frozenset(_GUIDE_DOC_TYPES_ORDER)
+_VALID_TAX_REGIMES = frozenset({"simples", "presumido", "real"})
+_VALID_COMPANY_SIZES = frozenset({"micro", "small", "medium", "large"})
+_SMALL_COMPANY_SIZES = frozenset({"micro", "small"})
+_VALID_UFS = frozenset({
+    "AC", "AL", "AP", "AM", "BA", "CE", "DF", "ES", "GO", "MA", "MT", "MS", "MG", "PA",
+    "PB", "PR", "PE", "PI", "RJ", "RN", "RS", "RO", "RR", "SC", "SP", "SE", "TO",
+})
+
+
+# Somente leitura: o corpo renderizado de cada tutorial fica em cache (ver _help_page_body).
+TUTORIALS: Mapping[str, dict] = MappingProxyType({
     "config_ia": {
         "title": "Configuração da IA (API e conhecimento)",
         "goal": "Configurar a IA com segurança, entender cada variável e manter o assistente atualizado com fontes confiáveis.",
@@ -344,13 +387,35 @@ TUTORIALS: dict[str, dict] = {
             "Se necessário, ajuste manualmente e reconfira no holerite/fechamento.",
         ],
     },
-}
+})
 
 
 @payroll_bp.get("/help")
 @login_required
 def help_index():
-    return render_template("payroll/help_index.html", tutorials=TUTORIALS)
+    # Página estática (TUTORIALS + templates): o navegador revalida pela ETag e recebe 304 sem renderização.
+    # Com mensagem flash pendente (ex.: tutorial não encontrado) a página é sempre renderizada.
+    etag = _help_index_etag()
+    if "_flashes" not in session and request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+    else:
+        resp = current_app.make_response(render_template("payroll/help_index.html", tutorials=TUTORIALS))
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
+def _help_index_etag() -> str:
+    etag = current_app.extensions.get("payroll_help_index_etag")
+    if etag is None:
+        env = current_app.jinja_env
+        digest = hashlib.sha1(repr(TUTORIALS).encode("utf-8"))
+        for name in ("base.html", "payroll/help_index.html"):
+            digest.update(env.loader.get_source(env, name)[0].encode("utf-8"))
+        etag = digest.hexdigest()
+        current_app.extensions["payroll_help_index_etag"] = etag
+    return etag
 
 
 @payroll_bp.get("/help/<slug>")
@@ -360,7 +425,18 @@ def help_page(slug: str):
     if not item:
         flash("Tutorial não encontrado.", "warning")
         return redirect(url_for("payroll.help_index"))
-    return render_template("payroll/help_page.html", slug=slug, item=item)
+    return render_template("payroll/help_page.html", slug=slug, item=item, body_html=_help_page_body(slug, item))
+
+
+def _help_page_body(slug: str, item: dict) -> Markup:
+    # TUTORIALS é constante: o corpo de cada tutorial é renderizado uma vez por app e reaproveitado;
+    # só a moldura (base.html, com usuário e mensagens) é renderizada a cada requisição.
+    cache = current_app.extensions.setdefault("payroll_help_html", {})
+    body = cache.get(slug)
+    if body is None:
+        body = Markup(render_template("payroll/help_page_body.html", slug=slug, item=item))
+        cache[slug] = body
+    return body
 
 
 def _env_flag(name: str, default: bool = False) -> bool:
@@ -414,8 +490,34 @@ def _ai_assistant_config() -> dict[str, object]:
     }
 
 
+@lru_cache(maxsize=32)
+def _ensure_dir(path: str) -> str:
+    # Cada diretório (por app/instance_path) é criado uma vez por processo, não a cada upload/leitura.
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# Se um diretório em cache for apagado com o processo rodando (limpeza da instância, volume remontado),
+# a gravação falha com FileNotFoundError: limpa o cache de _ensure_dir, recria o diretório e tenta uma vez.
+def _open_in_dir(path: str, mode: str, **kwargs):
+    try:
+        return open(path, mode, **kwargs)
+    except FileNotFoundError:
+        _ensure_dir.cache_clear()
+        _ensure_dir(os.path.dirname(path))
+        return open(path, mode, **kwargs)
+
+
+def _mkstemp_in(folder: str, suffix: str) -> tuple[int, str]:
+    try:
+        return tempfile.mkstemp(dir=folder, suffix=suffix)
+    except FileNotFoundError:
+        _ensure_dir.cache_clear()
+        return tempfile.mkstemp(dir=_ensure_dir(folder), suffix=suffix)
+
+
 def _ai_settings_file() -> str:
-    os.makedirs(current_app.instance_path, exist_ok=True)
+    _ensure_dir(current_app.instance_path)
     return os.path.join(current_app.instance_path, "ai_settings.json")
 
 
@@ -440,7 +542,7 @@ def _load_ai_settings_overrides() -> dict[str, str]:
 def _save_ai_settings_overrides(values: dict[str, str]) -> None:
     path = _ai_settings_file()
     payload = {k: v for k, v in values.items() if v is not None and str(v).strip() != ""}
-    with open(path, "w", encoding="utf-8") as fh:
+    with _open_in_dir(path, "w", encoding="utf-8") as fh:
         json.dump(payload, fh, ensure_ascii=False, indent=2)
 
 
@@ -665,12 +767,12 @@ def _build_ai_audit_report(cfg: dict[str, object], reviewed_sources: list[dict[s
 
 
 def _ai_cache_file() -> str:
-    os.makedirs(current_app.instance_path, exist_ok=True)
+    _ensure_dir(current_app.instance_path)
     return os.path.join(current_app.instance_path, "ai_knowledge_cache.json")
 
 
 def _ai_usage_log_file() -> str:
-    os.makedirs(current_app.instance_path, exist_ok=True)
+    _ensure_dir(current_app.instance_path)
     return os.path.join(current_app.instance_path, "ai_assistant_usage.jsonl")
 
 
@@ -691,7 +793,7 @@ def _load_ai_knowledge_cache() -> dict[str, object]:
 def _save_ai_knowledge_cache(cache: dict[str, object]) -> None:
     path = _ai_cache_file()
     try:
-        with open(path, "w", encoding="utf-8") as fh:
+        with _open_in_dir(path, "w", encoding="utf-8") as fh:
             json.dump(cache, fh, ensure_ascii=False, indent=2)
     except Exception as exc:
         current_app.logger.warning("Falha ao salvar cache de conhecimento IA: %s", exc)
@@ -981,30 +1083,29 @@ def _record_ai_usage(
     }
     try:
         path = _ai_usage_log_file()
-        with open(path, "a", encoding="utf-8") as fh:
+        with _open_in_dir(path, "a", encoding="utf-8") as fh:
             fh.write(json.dumps(row, ensure_ascii=False) + "\n")
     except Exception as exc:
         current_app.logger.warning("Falha ao registrar uso do assistente IA: %s", exc)
 
 
 def _build_ai_month_context(year: int, month: int) -> dict[str, object]:
-    run = PayrollRun.query.filter_by(year=year, month=month).first()
-    comp = date(int(year), int(month), 1)
-    _, inss_rows = _latest_inss_brackets(comp)
-    _, irrf_rows = _latest_irrf_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    closed = CompetenceClose.query.filter_by(year=year, month=month).first()
-
-    docs = {
-        "darf": GuideDocument.query.filter_by(year=year, month=month, doc_type="darf").first(),
-        "das": GuideDocument.query.filter_by(year=year, month=month, doc_type="das").first(),
-        "fgts": GuideDocument.query.filter_by(year=year, month=month, doc_type="fgts").first(),
-    }
+    ctx = _load_close_context(year, month)
+    run = ctx["run"]
+    inss_rows = ctx["inss_rows"]
+    irrf_rows = ctx["irrf_rows"]
+    irrf_cfg = ctx["irrf_cfg"]
+    closed = ctx["closed"]
+    docs = ctx["docs"]
     company = _company_row()
     company_readiness = _company_official_readiness(company)
-    employees_count = Employee.query.count()
-    active_employees_count = Employee.query.filter_by(active=True).count()
-    revenue_summary = _calc_revenue_month_summary(year, month)
+    employees_count, active_employees_count = db.session.query(
+        func.count(Employee.id),
+        func.coalesce(func.sum(case((Employee.active.is_(True), 1), else_=0)), 0),
+    ).one()
+    employees_count = int(employees_count or 0)
+    active_employees_count = int(active_employees_count or 0)
+    revenue_summary = ctx["revenue_summary"]
 
     checklist = [
         {
@@ -1158,14 +1259,14 @@ def ai_assistant():
     source = str(payload.get("source") or "monthly_guide").strip() or "monthly_guide"
 
     try:
-        year = int(payload.get("year") or datetime.now().year)
-        month = int(payload.get("month") or datetime.now().month)
+        year = int(payload.get("year") or _request_now().year)
+        month = int(payload.get("month") or _request_now().month)
     except (TypeError, ValueError):
         return jsonify({"ok": False, "error": "Ano/mês inválidos."}), 400
 
     if not question:
         return jsonify({"ok": False, "error": "Digite sua pergunta para o assistente."}), 400
-    if year < 2000 or month < 1 or month > 12:
+    if not _valid_competence(year, month):
         return jsonify({"ok": False, "error": "Competência inválida."}), 400
 
     context = _build_ai_month_context(year=year, month=month)
@@ -1232,35 +1333,55 @@ def ai_knowledge_refresh():
     )
 
 
-def _guide_step_keys() -> set[str]:
-    return {"company_profile", "employees", "revenue", "payroll", "taxes", "guides", "close"}
+_GUIDE_STEP_BITS = {
+    "company_profile": 1,
+    "employees": 2,
+    "revenue": 4,
+    "payroll": 8,
+    "taxes": 16,
+    "guides": 32,
+    "close": 64,
+}
+_GUIDE_STEP_KEYS = frozenset(_GUIDE_STEP_BITS)
+_GUIDE_STEP_ACTIONS = frozenset({"done", "undone"})
 
 
 def _guide_session_key(year: int, month: int) -> str:
     return f"payroll_guide_done:{int(year)}-{int(month)}"
 
 
+def _guide_done_mask(raw) -> int:
+    """Lê o progresso manual da sessão como bitmask (aceita a lista antiga de chaves)."""
+    if isinstance(raw, (list, tuple, set)):
+        return sum(_GUIDE_STEP_BITS.get(k, 0) for k in set(raw))
+    try:
+        return int(raw or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
 @payroll_bp.post("/guide/step")
 @login_required
 def monthly_guide_step_toggle():
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
+    year, month = _form_competence()
     step_key = (request.form.get("step_key") or "").strip().lower()
     action = (request.form.get("action") or "").strip().lower()
 
-    if year < 2000 or month < 1 or month > 12 or step_key not in _guide_step_keys() or action not in {"done", "undone"}:
+    if not _valid_competence(year, month) or step_key not in _GUIDE_STEP_KEYS or action not in _GUIDE_STEP_ACTIONS:
         flash("Ação do modo guiado inválida.", "warning")
         return redirect(url_for("payroll.monthly_guide"))
 
     s_key = _guide_session_key(year, month)
-    done = set(session.get(s_key, []))
-
-    if action == "done":
-        done.add(step_key)
-    elif step_key in done:
-        done.remove(step_key)
-
-    session[s_key] = sorted(done)
+    raw = session.get(s_key)
+    bit = _GUIDE_STEP_BITS[step_key]
+    mask = _guide_done_mask(raw)
+    mask = mask | bit if action == "done" else mask & ~bit
+
+    # Competência sem passos marcados sai da sessão (cookie menor); sem mudança a chave não é regravada.
+    if not mask:
+        session.pop(s_key, None)
+    elif mask != raw:
+        session[s_key] = mask
     flash("Progresso do modo guiado atualizado.", "success")
     return redirect(url_for("payroll.monthly_guide", year=year, month=month))
 
@@ -1268,10 +1389,9 @@ def monthly_guide_step_toggle():
 @payroll_bp.post("/guide/reset")
 @login_required
 def monthly_guide_reset():
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
+    year, month = _form_competence()
 
-    if year < 2000 or month < 1 or month > 12:
+    if not _valid_competence(year, month):
         flash("Competência inválida.", "warning")
         return redirect(url_for("payroll.monthly_guide"))
 
@@ -1283,33 +1403,30 @@ def monthly_guide_reset():
 @payroll_bp.get("/guide")
 @login_required
 def monthly_guide():
-    now = datetime.now()
+    now = _request_now()
     year = int(request.args.get("year") or now.year)
     month = int(request.args.get("month") or now.month)
 
-    run = PayrollRun.query.filter_by(year=year, month=month).first()
-    comp = date(int(year), int(month), 1)
-    inss_eff, inss_rows = _latest_inss_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
-    closed = CompetenceClose.query.filter_by(year=year, month=month).first()
-
-    docs = {
-        "darf": GuideDocument.query.filter_by(year=year, month=month, doc_type="darf").first(),
-        "das": GuideDocument.query.filter_by(year=year, month=month, doc_type="das").first(),
-        "fgts": GuideDocument.query.filter_by(year=year, month=month, doc_type="fgts").first(),
-    }
-
-    employees_count = Employee.query.count()
-    active_employees_count = Employee.query.filter_by(active=True).count()
-    revenue_summary = _calc_revenue_month_summary(year, month)
-    vacations_summary = _calc_vacations_month_summary(year, month)
-    thirteenth_summary = _calc_thirteenth_month_summary(year, month)
-    terminations_summary = _calc_terminations_month_summary(year, month)
-    leaves_summary = _calc_leaves_month_summary(year, month)
+    # O guia só precisa saber se folha, fechamento e guias existem: EXISTS no mesmo SELECT dos resumos,
+    # sem carregar as linhas (o fechamento, que usa os objetos, continua com _load_close_context).
+    tables = _tax_tables_for(_competence_start(year, month))
+    inss_eff, inss_rows = tables["inss_eff"], tables["inss_rows"]
+    irrf_cfg = tables["irrf_cfg"]
+    irrf_eff, irrf_rows = tables["irrf_eff"], tables["irrf_rows"]
+    summaries = _calc_all_month_summaries(year, month)
+    presence = summaries["presence"]
+
+    employees_count = summaries["employees"]["count"]
+    active_employees_count = summaries["employees"]["active_count"]
+    revenue_summary = summaries["revenue"]
+    vacations_summary = summaries["vacations"]
+    thirteenth_summary = summaries["thirteenth"]
+    terminations_summary = summaries["terminations"]
+    leaves_summary = summaries["leaves"]
 
     company = _company_row()
     company_readiness = _company_official_readiness(company)
+    close_url = url_for("payroll.close_home", year=year, month=month)
 
     steps = [
         {
@@ -1339,7 +1456,7 @@ def monthly_guide():
         {
             "key": "payroll",
             "title": "3) Folha mensal",
-            "auto_done": bool(run),
+            "auto_done": presence["run"],
             "desc": "Crie/abra a folha do mês e salve os lançamentos de horas extras.",
             "action_url": url_for("payroll.payroll_home", year=year, month=month),
             "action_label": "Abrir folha",
@@ -1355,32 +1472,36 @@ def monthly_guide():
         {
             "key": "guides",
             "title": "5) Guias da competência",
-            "auto_done": all(bool(docs.get(k)) for k in ("darf", "das", "fgts")),
+            "auto_done": all(presence["guides"].values()),
             "desc": "Anexe os PDFs de DARF, DAS e FGTS para centralizar conferência.",
-            "action_url": url_for("payroll.close_home", year=year, month=month),
+            "action_url": close_url,
             "action_label": "Anexar guias",
         },
         {
             "key": "close",
             "title": "6) Encerramento do mês",
-            "auto_done": bool(closed),
+            "auto_done": presence["closed"],
             "desc": "Depois de tudo conferido, marque a competência como fechada.",
-            "action_url": url_for("payroll.close_home", year=year, month=month),
+            "action_url": close_url,
             "action_label": "Ir para fechamento",
         },
     ]
 
-    reviewed_steps = set(session.get(_guide_session_key(year, month), []))
+    reviewed_mask = _guide_done_mask(session.get(_guide_session_key(year, month)))
+    reviewed_steps = {k for k, bit in _GUIDE_STEP_BITS.items() if reviewed_mask & bit}
+    done_steps = 0
+    next_step = None
     for s in steps:
         s["manual_done"] = s["key"] in reviewed_steps
-        s["done"] = bool(s.get("auto_done")) or bool(s.get("manual_done"))
+        s["done"] = bool(s["auto_done"]) or s["manual_done"]
+        if s["done"]:
+            done_steps += 1
+        elif next_step is None:
+            next_step = s
 
     total_steps = len(steps)
-    done_steps = sum(1 for s in steps if s.get("done"))
     progress_pct = int((done_steps * 100) / total_steps) if total_steps else 0
 
-    next_step = next((s for s in steps if not s.get("done")), None)
-
     return render_template(
         "payroll/monthly_guide.html",
         year=year,
@@ -1402,7 +1523,7 @@ def monthly_guide():
     )
 
 
-def _to_decimal(v: str | None, default: Decimal = Decimal("0")) -> Decimal:
+def _to_decimal(v: str | None, default: Decimal = _ZERO) -> Decimal:
     try:
         if v is None:
             return default
@@ -1410,87 +1531,163 @@ def _to_decimal(v: str | None, default: Decimal = Decimal("0")) -> Decimal:
         if not s:
             return default
         s = s.replace(".", "").replace(",", ".") if "," in s else s
-        return Decimal(s)
+        d = Decimal(s)
+        return d if d.is_finite() else default
     except (InvalidOperation, ValueError):
         return default
 
 
+@lru_cache(maxsize=1024)
 def _monthly_hours_from_weekly(weekly_hours: Decimal | None) -> Decimal:
-    weekly = Decimal(str(weekly_hours or 0))
+    weekly = Decimal(weekly_hours or 0)
     if weekly <= 0:
-        weekly = Decimal("44")
-    return (weekly * Decimal("5")).quantize(Decimal("0.01"))
+        weekly = _DEFAULT_WEEKLY_HOURS
+    return (weekly * _FIVE).quantize(_CENT)
 
 
+@lru_cache(maxsize=1024)
 def _overtime_rate_from_salary(base_salary: Decimal | None, weekly_hours: Decimal | None, additional_pct: Decimal | None) -> Decimal:
-    base = Decimal(str(base_salary or 0))
+    base = Decimal(base_salary or 0)
     month_hours = _monthly_hours_from_weekly(weekly_hours)
-    additional = Decimal(str(additional_pct or 0))
+    additional = Decimal(additional_pct or 0)
     if additional < 0:
-        additional = Decimal("0")
+        additional = _ZERO
     if base <= 0 or month_hours <= 0:
-        return Decimal("0")
-    multiplier = Decimal("1") + (additional / Decimal("100"))
-    return ((base / month_hours) * multiplier).quantize(Decimal("0.01"))
+        return _ZERO
+    multiplier = _ONE + (additional / _HUNDRED)
+    return ((base / month_hours) * multiplier).quantize(_CENT)
+
+
+def _request_now() -> datetime:
+    # Um único relógio por requisição: todas as telas/prazos da mesma requisição veem o mesmo instante.
+    now = g.get("request_now")
+    if now is None:
+        now = datetime.now()
+        g.request_now = now
+    return now
+
+
+def _request_today() -> date:
+    return _request_now().date()
+
+
+@payroll_bp.before_request
+def _capture_request_clock() -> None:
+    _request_now()
+
+
+def _form_int(name: str, default: int = 0) -> int:
+    try:
+        return int((request.form.get(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _arg_int(name: str, default: int) -> int:
+    try:
+        return int((request.args.get(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _form_competence() -> tuple[int, int]:
+    # Valores não numéricos viram 0 e caem no aviso "Competência inválida" em vez de erro 500.
+    return _form_int("year"), _form_int("month")
+
+
+def _valid_competence(year: int, month: int) -> bool:
+    return 2000 <= year <= 9999 and 1 <= month <= 12
+
+
+_ISO_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+_BR_DATE_RE = re.compile(r"(\d{1,2})\s*/\s*(\d{1,2})\s*/\s*(\d{1,4})")
 
 
 def _parse_date(v: str | None) -> date | None:
     s = (v or "").strip()
     if not s:
         return None
+    # Formatos usuais (input date e dd/mm/aaaa) resolvidos por regex; fromisoformat fica para as demais variantes ISO.
     try:
-        return date.fromisoformat(s)
-    except Exception:
-        pass
-    try:
-        parts = s.split("/")
-        if len(parts) != 3:
+        m = _ISO_DATE_RE.fullmatch(s)
+        if m:
+            return date(int(m[1]), int(m[2]), int(m[3]))
+        m = _BR_DATE_RE.fullmatch(s)
+        if m:
+            dd, mm, yyyy = m.groups()
+            if len(yyyy) == 2:
+                yyyy = "20" + yyyy
+            return date(int(yyyy), int(mm), int(dd))
+        if "/" in s:
             return None
-        dd, mm, yyyy = (p.strip() for p in parts)
-        if len(yyyy) == 2:
-            yyyy = "20" + yyyy
-        return date(int(yyyy), int(mm), int(dd))
-    except Exception:
+        return date.fromisoformat(s)
+    except ValueError:
         return None
 
 
+_NON_DIGITS_RE = re.compile(r"[^0-9]+")
+
+
 def _digits_only(v: str | None) -> str:
-    return "".join(ch for ch in str(v or "") if ch.isdigit())
+    return _NON_DIGITS_RE.sub("", str(v or ""))
+
+
+# Pesos do dígito verificador módulo 11 (CPF, PIS e CNPJ). Os validadores são funções puras de str -> bool
+# e ficam memoizados: a prontidão da empresa revalida os mesmos CNPJ/CPF a cada tela de cadastro/eSocial.
+_CPF_W1 = (10, 9, 8, 7, 6, 5, 4, 3, 2)
+_CPF_W2 = (11, 10, 9, 8, 7, 6, 5, 4, 3, 2)
+_PIS_W = (3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+_CNPJ_W1 = (5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+_CNPJ_W2 = (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+
+
+def _mod11_sum(digits: str, weights: tuple[int, ...]) -> int:
+    # Só recebe dígitos ASCII (_digits_only): ord(d) - 48 evita o int() por caractere.
+    return sum((ord(d) - 48) * w for d, w in zip(digits, weights))
+
+
+def _mod11_check_digit(digits: str, weights: tuple[int, ...]) -> str:
+    mod = _mod11_sum(digits, weights) % 11
+    return "0" if mod < 2 else str(11 - mod)
 
 
+@lru_cache(maxsize=2048)
 def _is_valid_cpf(v: str | None) -> bool:
     cpf = _digits_only(v)
     if len(cpf) != 11:
         return False
     if cpf == cpf[0] * 11:
         return False
-
-    def _digit(base: str, factor: int) -> int:
-        total = 0
-        for n in base:
-            total += int(n) * factor
-            factor -= 1
-        mod = total % 11
-        return 0 if mod < 2 else 11 - mod
-
-    d1 = _digit(cpf[:9], 10)
-    d2 = _digit(cpf[:9] + str(d1), 11)
-    return cpf[-2:] == f"{d1}{d2}"
+    return cpf[9] == _mod11_check_digit(cpf, _CPF_W1) and cpf[10] == _mod11_check_digit(cpf, _CPF_W2)
 
 
+@lru_cache(maxsize=2048)
 def _is_valid_pis(v: str | None) -> bool:
     pis = _digits_only(v)
     if len(pis) != 11:
         return False
     if pis == pis[0] * 11:
         return False
-    weights = [3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
-    total = sum(int(pis[i]) * weights[i] for i in range(10))
-    remainder = 11 - (total % 11)
+    remainder = 11 - (_mod11_sum(pis, _PIS_W) % 11)
     check = 0 if remainder in (10, 11) else remainder
     return check == int(pis[10])
 
 
+def _employee_duplicates(cpf: str | None, pis: str | None, exclude_id: int | None = None) -> tuple[bool, bool]:
+    """(CPF em uso, PIS em uso) por outro funcionário, verificados num único SELECT de EXISTS."""
+    checks = {}
+    for key, column, value in (("cpf", Employee.cpf, cpf), ("pis", Employee.pis, pis)):
+        if value:
+            q = db.session.query(Employee.id).filter(column == value)
+            if exclude_id:
+                q = q.filter(Employee.id != int(exclude_id))
+            checks[key] = q.exists()
+    if not checks:
+        return False, False
+    found = dict(zip(checks, db.session.query(*checks.values()).one()))
+    return bool(found.get("cpf")), bool(found.get("pis"))
+
+
 def _validate_employee_official_minimum(
     *,
     full_name: str,
@@ -1519,36 +1716,49 @@ def _validate_employee_official_minimum(
         errors.append("Informe o cargo/função (cadastro oficial mínimo).")
 
     normalized_cpf = _digits_only(cpf) if cpf else None
-    if normalized_cpf:
-        q = Employee.query.filter(Employee.cpf == normalized_cpf)
-        if employee_id:
-            q = q.filter(Employee.id != int(employee_id))
-        if q.first() is not None:
-            errors.append("Já existe funcionário com este CPF.")
-
     normalized_pis = _digits_only(pis) if pis else None
+    cpf_taken, pis_taken = _employee_duplicates(normalized_cpf, normalized_pis, exclude_id=employee_id)
+    if cpf_taken:
+        errors.append("Já existe funcionário com este CPF.")
+
     if normalized_pis:
         if not _is_valid_pis(normalized_pis):
             errors.append("PIS inválido. Verifique os 11 dígitos.")
-        q = Employee.query.filter(Employee.pis == normalized_pis)
-        if employee_id:
-            q = q.filter(Employee.id != int(employee_id))
-        if q.first() is not None:
+        if pis_taken:
             errors.append("Já existe funcionário com este PIS.")
 
     return errors
 
 
 def _media_guides_dir() -> str:
-    p = os.path.join(current_app.instance_path, "media", "guides")
-    os.makedirs(p, exist_ok=True)
-    return p
+    return _ensure_dir(os.path.join(current_app.instance_path, "media", "guides"))
+
+
+_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _is_pdf_upload(f) -> bool:
+    header = f.stream.read(5)
+    f.stream.seek(0)
+    return header == b"%PDF-"
+
+
+def _save_upload_atomically(f, target_path: str) -> None:
+    # Grava em blocos num arquivo temporário e publica com os.replace: quem lê o PDF
+    # (download/validação) nunca vê um arquivo pela metade.
+    # Nome temporário único no mesmo diretório: uploads simultâneos não disputam o mesmo ".part".
+    fd, tmp_path = _mkstemp_in(os.path.dirname(target_path), ".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            shutil.copyfileobj(f.stream, out, length=_UPLOAD_CHUNK_SIZE)
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def _media_esocial_dir() -> str:
-    p = os.path.join(current_app.instance_path, "media", "esocial")
-    os.makedirs(p, exist_ok=True)
-    return p
+    return _ensure_dir(os.path.join(current_app.instance_path, "media", "esocial"))
 
 
 def _add_evidence_event(
@@ -1560,6 +1770,7 @@ def _add_evidence_event(
     entity_key: str | None = None,
     details: str | None = None,
 ) -> None:
+    """Registra o evento na transação de quem chamou; o commit da própria ação grava os dois juntos."""
     actor_email = getattr(current_user, "email", None)
     db.session.add(
         ComplianceEvidenceEvent(
@@ -1591,7 +1802,7 @@ def _validate_guide_document(
     elif filename != expected_name:
         warnings.append("Nome do PDF fora do padrão da competência.")
 
-    amount = Decimal(str(getattr(doc, "amount", 0) or 0))
+    amount = Decimal(getattr(doc, "amount", 0) or 0)
     if amount <= 0:
         warnings.append("Valor da guia não informado.")
 
@@ -1625,30 +1836,27 @@ def _validate_guide_document(
     }
 
 
+@lru_cache(maxsize=2048)
 def _is_valid_cnpj(v: str | None) -> bool:
     cnpj = _digits_only(v)
     if len(cnpj) != 14:
         return False
     if cnpj == cnpj[0] * 14:
         return False
-
-    def _digit(base: str, weights: list[int]) -> int:
-        total = sum(int(base[i]) * weights[i] for i in range(len(weights)))
-        mod = total % 11
-        return 0 if mod < 2 else 11 - mod
-
-    d1 = _digit(cnpj[:12], [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
-    d2 = _digit(cnpj[:12] + str(d1), [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
-    return cnpj[-2:] == f"{d1}{d2}"
+    return cnpj[12] == _mod11_check_digit(cnpj, _CNPJ_W1) and cnpj[13] == _mod11_check_digit(cnpj, _CNPJ_W2)
 
 
 def _company_row() -> Company:
-    row = Company.query.order_by(Company.id.asc()).first()
-    if row:
+    # Memoizado por requisição: o cadastro da empresa é lido pela tela e pelo contexto da IA na mesma requisição.
+    row = g.get("_company_row")
+    if row is not None:
         return row
-    row = Company()
-    db.session.add(row)
-    db.session.commit()
+    row = Company.query.order_by(Company.id.asc()).first()
+    if row is None:
+        row = Company()
+        db.session.add(row)
+        db.session.commit()
+    g._company_row = row
     return row
 
 
@@ -1665,16 +1873,16 @@ def _validate_company_official_minimum(payload: dict) -> list[str]:
         errors.append("Informe a razão social.")
     if not payload.get("cnae"):
         errors.append("Informe o CNAE principal.")
-    if payload.get("tax_regime") not in {"simples", "presumido", "real"}:
+    if payload.get("tax_regime") not in _VALID_TAX_REGIMES:
         errors.append("Selecione um regime tributário válido.")
     if not payload.get("esocial_classification"):
         errors.append("Informe a classificação tributária eSocial (classTrib).")
-    if payload.get("company_size") not in {"micro", "small", "medium", "large"}:
+    if payload.get("company_size") not in _VALID_COMPANY_SIZES:
         errors.append("Selecione o porte da empresa.")
     if not payload.get("city") or not payload.get("state"):
         errors.append("Informe cidade e UF.")
-    elif len((payload.get("state") or "").strip()) != 2:
-        errors.append("UF deve conter 2 letras (ex.: RS).")
+    elif (payload.get("state") or "").strip().upper() not in _VALID_UFS:
+        errors.append("UF inválida. Informe a sigla de 2 letras (ex.: RS).")
 
     if not payload.get("responsible_name"):
         errors.append("Informe o responsável legal.")
@@ -1721,12 +1929,14 @@ def _esocial_schema_dir() -> str:
     return os.path.join(os.path.dirname(__file__), "schemas", "esocial", "v_s_01_03_00")
 
 
+_ESOCIAL_XSD_FILES = {
+    "S-1000": "evtInfoEmpregador.xsd",
+    "S-1005": "evtTabEstab.xsd",
+}
+
+
 def _esocial_xsd_path(event_type: str) -> str | None:
-    mapping = {
-        "S-1000": "evtInfoEmpregador.xsd",
-        "S-1005": "evtTabEstab.xsd",
-    }
-    name = mapping.get((event_type or "").upper())
+    name = _ESOCIAL_XSD_FILES.get((event_type or "").upper())
     if not name:
         return None
     return os.path.join(_esocial_schema_dir(), name)
@@ -1734,7 +1944,7 @@ def _esocial_xsd_path(event_type: str) -> str | None:
 
 def _esocial_schema_readiness() -> dict:
     checks = []
-    for event_type in ("S-1000", "S-1005"):
+    for event_type in _ESOCIAL_XSD_FILES:
         p = _esocial_xsd_path(event_type)
         ok = bool(p and os.path.exists(p))
         checks.append({"event_type": event_type, "ok": ok, "path": p})
@@ -1745,10 +1955,8 @@ def _esocial_schema_readiness() -> dict:
 
 
 def _esocial_event_id() -> str:
-    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-    tail = "".join(str(b % 10) for b in os.urandom(14))
-    token = (stamp + tail)[:34]
-    return f"ID{token}"
+    # Identificador do arquivo gerado, não segredo: o `random` global basta (é ressemeado a cada fork do gunicorn).
+    return f"ID{datetime.utcnow():%Y%m%d%H%M%S%f}{random.randrange(10**14):014d}"[:36]
 
 
 def _esocial_dummy_signature() -> str:
@@ -1767,6 +1975,13 @@ def _esocial_dummy_signature() -> str:
     )
 
 
+@lru_cache(maxsize=8)
+def _esocial_xml_schema(xsd_path: str, mtime: float) -> etree.XMLSchema:
+    # Compilar o XSD oficial (com os imports de assinatura) custa bem mais que validar o XML;
+    # o schema compilado fica por processo e a mtime na chave recarrega um XSD atualizado.
+    return etree.XMLSchema(etree.parse(xsd_path))
+
+
 def _validate_esocial_xml_xsd(event_type: str, xml_content: str) -> dict:
     xsd_path = _esocial_xsd_path(event_type)
     if not xsd_path or not os.path.exists(xsd_path):
@@ -1777,21 +1992,28 @@ def _validate_esocial_xml_xsd(event_type: str, xml_content: str) -> dict:
         }
 
     try:
-        schema_doc = etree.parse(xsd_path)
-        schema = etree.XMLSchema(schema_doc)
-        xml_doc = etree.fromstring(xml_content.encode("utf-8"))
-        valid = schema.validate(xml_doc)
-        if valid:
+        schema = _esocial_xml_schema(xsd_path, os.path.getmtime(xsd_path))
+        # Parser com o schema: a validação acontece durante o parse, numa passada só sobre o documento.
+        parser = etree.XMLParser(schema=schema, collect_ids=False)
+        etree.fromstring(xml_content.encode("utf-8"), parser)
+        return {
+            "status": "ok",
+            "summary": "XML válido no XSD oficial.",
+            "errors": [],
+        }
+    except etree.XMLSyntaxError as e:
+        schema_errors = [err for err in e.error_log if err.domain == etree.ErrorDomains.SCHEMASV]
+        if not schema_errors:
+            # XML malformado (não chegou a ser validado contra o XSD).
             return {
-                "status": "ok",
-                "summary": "XML válido no XSD oficial.",
-                "errors": [],
+                "status": "danger",
+                "summary": "Falha técnica na validação XSD.",
+                "errors": [str(e)],
             }
-        errors = [str(err.message) for err in schema.error_log][:5]
         return {
             "status": "danger",
             "summary": "XML inválido no XSD oficial.",
-            "errors": errors,
+            "errors": [str(err.message) for err in schema_errors][:5],
         }
     except Exception as e:
         return {
@@ -1801,80 +2023,89 @@ def _validate_esocial_xml_xsd(event_type: str, xml_content: str) -> dict:
         }
 
 
-def _esocial_xml_s1000(company: Company) -> str:
-    cnpj = xml_escape(company.cnpj or "")
-    classtrib = xml_escape(company.esocial_classification or "")
-    ind_porte = "S" if (company.company_size or "") in {"micro", "small"} else ""
-    ini_valid = datetime.utcnow().strftime("%Y-%m")
-    event_id = _esocial_event_id()
+_ESOCIAL_S1000_TEMPLATE = (
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    "<eSocial xmlns=\"http://www.esocial.gov.br/schema/evt/evtInfoEmpregador/v_S_01_03_00\" xmlns:ds=\"http://www.w3.org/2000/09/xmldsig#\">\n"
+    "  <evtInfoEmpregador Id=\"{event_id}\">\n"
+    "    <ideEvento>\n"
+    "      <tpAmb>2</tpAmb>\n"
+    "      <procEmi>1</procEmi>\n"
+    "      <verProc>sistema-contabilidade-1.0</verProc>\n"
+    "    </ideEvento>\n"
+    "    <ideEmpregador>\n"
+    "      <tpInsc>1</tpInsc>\n"
+    "      <nrInsc>{cnpj}</nrInsc>\n"
+    "    </ideEmpregador>\n"
+    "    <infoEmpregador>\n"
+    "      <inclusao>\n"
+    "        <idePeriodo>\n"
+    "          <iniValid>{ini_valid}</iniValid>\n"
+    "        </idePeriodo>\n"
+    "        <infoCadastro>\n"
+    "          <classTrib>{classtrib}</classTrib>\n"
+    "          <indDesFolha>{ind_des_folha}</indDesFolha>\n"
+    "          {ind_porte_xml}"
+    "          <indOptRegEletron>1</indOptRegEletron>\n"
+    "        </infoCadastro>\n"
+    "      </inclusao>\n"
+    "    </infoEmpregador>\n"
+    "  </evtInfoEmpregador>\n"
+    "{signature}"
+    "</eSocial>\n"
+)
 
-    ind_porte_xml = f"        <indPorte>{ind_porte}</indPorte>\n" if ind_porte else ""
-    return (
-        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-        "<eSocial xmlns=\"http://www.esocial.gov.br/schema/evt/evtInfoEmpregador/v_S_01_03_00\" xmlns:ds=\"http://www.w3.org/2000/09/xmldsig#\">\n"
-        f"  <evtInfoEmpregador Id=\"{event_id}\">\n"
-        "    <ideEvento>\n"
-        "      <tpAmb>2</tpAmb>\n"
-        "      <procEmi>1</procEmi>\n"
-        "      <verProc>sistema-contabilidade-1.0</verProc>\n"
-        "    </ideEvento>\n"
-        "    <ideEmpregador>\n"
-        "      <tpInsc>1</tpInsc>\n"
-        f"      <nrInsc>{cnpj}</nrInsc>\n"
-        "    </ideEmpregador>\n"
-        "    <infoEmpregador>\n"
-        "      <inclusao>\n"
-        "        <idePeriodo>\n"
-        f"          <iniValid>{ini_valid}</iniValid>\n"
-        "        </idePeriodo>\n"
-        "        <infoCadastro>\n"
-        f"          <classTrib>{classtrib}</classTrib>\n"
-        f"          <indDesFolha>{1 if company.payroll_tax_relief else 0}</indDesFolha>\n"
-        f"          {ind_porte_xml}"
-        "          <indOptRegEletron>1</indOptRegEletron>\n"
-        "        </infoCadastro>\n"
-        "      </inclusao>\n"
-        "    </infoEmpregador>\n"
-        "  </evtInfoEmpregador>\n"
-        f"{_esocial_dummy_signature()}"
-        "</eSocial>\n"
+_ESOCIAL_S1005_TEMPLATE = (
+    "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    "<eSocial xmlns=\"http://www.esocial.gov.br/schema/evt/evtTabEstab/v_S_01_03_00\" xmlns:ds=\"http://www.w3.org/2000/09/xmldsig#\">\n"
+    "  <evtTabEstab Id=\"{event_id}\">\n"
+    "    <ideEvento>\n"
+    "      <tpAmb>2</tpAmb>\n"
+    "      <procEmi>1</procEmi>\n"
+    "      <verProc>sistema-contabilidade-1.0</verProc>\n"
+    "    </ideEvento>\n"
+    "    <ideEmpregador>\n"
+    "      <tpInsc>1</tpInsc>\n"
+    "      <nrInsc>{cnpj_emp}</nrInsc>\n"
+    "    </ideEmpregador>\n"
+    "    <infoEstab>\n"
+    "      <inclusao>\n"
+    "        <ideEstab>\n"
+    "          <tpInsc>1</tpInsc>\n"
+    "          <nrInsc>{cnpj_est}</nrInsc>\n"
+    "          <iniValid>{ini_valid}</iniValid>\n"
+    "        </ideEstab>\n"
+    "        <dadosEstab>\n"
+    "          <cnaePrep>{cnae_est}</cnaePrep>\n"
+    "        </dadosEstab>\n"
+    "      </inclusao>\n"
+    "    </infoEstab>\n"
+    "  </evtTabEstab>\n"
+    "{signature}"
+    "</eSocial>\n"
+)
+
+
+def _esocial_xml_s1000(company: Company) -> str:
+    ind_porte = "S" if company.company_size in _SMALL_COMPANY_SIZES else ""
+    return _ESOCIAL_S1000_TEMPLATE.format(
+        event_id=_esocial_event_id(),
+        cnpj=xml_escape(company.cnpj or ""),
+        ini_valid=datetime.utcnow().strftime("%Y-%m"),
+        classtrib=xml_escape(company.esocial_classification or ""),
+        ind_des_folha=1 if company.payroll_tax_relief else 0,
+        ind_porte_xml=f"        <indPorte>{ind_porte}</indPorte>\n" if ind_porte else "",
+        signature=_esocial_dummy_signature(),
     )
 
 
 def _esocial_xml_s1005(company: Company) -> str:
-    cnpj_emp = xml_escape(company.cnpj or "")
-    cnpj_est = xml_escape((company.establishment_cnpj or company.cnpj or "")[:14])
-    cnae_est = xml_escape((_digits_only(company.establishment_cnae or company.cnae) or "")[:7])
-    ini_valid = datetime.utcnow().strftime("%Y-%m")
-    event_id = _esocial_event_id()
-    return (
-        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
-        "<eSocial xmlns=\"http://www.esocial.gov.br/schema/evt/evtTabEstab/v_S_01_03_00\" xmlns:ds=\"http://www.w3.org/2000/09/xmldsig#\">\n"
-        f"  <evtTabEstab Id=\"{event_id}\">\n"
-        "    <ideEvento>\n"
-        "      <tpAmb>2</tpAmb>\n"
-        "      <procEmi>1</procEmi>\n"
-        "      <verProc>sistema-contabilidade-1.0</verProc>\n"
-        "    </ideEvento>\n"
-        "    <ideEmpregador>\n"
-        "      <tpInsc>1</tpInsc>\n"
-        f"      <nrInsc>{cnpj_emp}</nrInsc>\n"
-        "    </ideEmpregador>\n"
-        "    <infoEstab>\n"
-        "      <inclusao>\n"
-        "        <ideEstab>\n"
-        "          <tpInsc>1</tpInsc>\n"
-        f"          <nrInsc>{cnpj_est}</nrInsc>\n"
-        f"          <iniValid>{ini_valid}</iniValid>\n"
-        "        </ideEstab>\n"
-        "        <dadosEstab>\n"
-        f"          <cnaePrep>{cnae_est}</cnaePrep>\n"
-        "        </dadosEstab>\n"
-        "      </inclusao>\n"
-        "    </infoEstab>\n"
-        "  </evtTabEstab>\n"
-        f"{_esocial_dummy_signature()}"
-        "</eSocial>\n"
+    return _ESOCIAL_S1005_TEMPLATE.format(
+        event_id=_esocial_event_id(),
+        cnpj_emp=xml_escape(company.cnpj or ""),
+        cnpj_est=xml_escape((company.establishment_cnpj or company.cnpj or "")[:14]),
+        cnae_est=xml_escape((_digits_only(company.establishment_cnae or company.cnae) or "")[:7]),
+        ini_valid=datetime.utcnow().strftime("%Y-%m"),
+        signature=_esocial_dummy_signature(),
     )
 
 
@@ -1882,7 +2113,7 @@ def _save_esocial_xml(event_type: str, xml_content: str) -> str:
     stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
     filename = f"esocial_{event_type.lower()}_{stamp}.xml"
     path = os.path.join(_media_esocial_dir(), filename)
-    with open(path, "w", encoding="utf-8") as fp:
+    with _open_in_dir(path, "w", encoding="utf-8") as fp:
         fp.write(xml_content)
     return filename
 
@@ -2031,6 +2262,7 @@ def esocial_assisted_mark_sent(submission_id: int):
     return redirect(url_for("payroll.esocial_assisted_home"))
 
 
+@lru_cache(maxsize=1024)
 def _competence_start(year: int, month: int) -> date:
     return date(int(year), int(month), 1)
 
@@ -2040,78 +2272,177 @@ def _competence_is_closed(year: int, month: int) -> bool:
 
 
 def _calc_revenue_month_summary(year: int, month: int) -> dict:
-    notes = RevenueNote.query.filter_by(year=int(year), month=int(month)).all()
-    total = Decimal("0")
-    for n in notes:
-        try:
-            total += Decimal(str(n.amount or 0))
-        except Exception:
-            total += Decimal("0")
-    total = total.quantize(Decimal("0.01"))
+    count, total = (
+        db.session.query(func.count(RevenueNote.id), func.coalesce(func.sum(RevenueNote.amount), 0))
+        .filter(RevenueNote.year == int(year), RevenueNote.month == int(month))
+        .one()
+    )
     return {
-        "count": len(notes),
-        "total": total,
+        "count": int(count or 0),
+        "total": Decimal(total or 0).quantize(_CENT),
     }
 
 
-def _calc_vacation_amounts(base_salary: Decimal, days: int, sell_days: int) -> dict:
+def _vacation_calculator(base_salary: Decimal):
     # Fixed-salary version (no averages). Uses 30-day base.
-    d = max(0, int(days or 0))
-    s = max(0, int(sell_days or 0))
-    daily = (base_salary / Decimal("30")) if base_salary > 0 else Decimal("0")
-    vacation_pay = (daily * Decimal(str(d))).quantize(Decimal("0.01"))
-    vacation_one_third = (vacation_pay / Decimal("3")).quantize(Decimal("0.01"))
-    abono_pay = (daily * Decimal(str(s))).quantize(Decimal("0.01"))
-    abono_one_third = (abono_pay / Decimal("3")).quantize(Decimal("0.01"))
-    gross_total = (vacation_pay + vacation_one_third + abono_pay + abono_one_third).quantize(Decimal("0.01"))
-    return {
-        "daily": daily.quantize(Decimal("0.0001")) if daily else Decimal("0"),
-        "vacation_pay": vacation_pay,
-        "vacation_one_third": vacation_one_third,
-        "abono_pay": abono_pay,
-        "abono_one_third": abono_one_third,
-        "gross_total": gross_total,
-    }
+    # The daily rate (a Decimal division) is computed once per salary; the returned
+    # function only multiplies it by the days of each vacation/abono.
+    daily = (base_salary / _THIRTY) if base_salary > 0 else _ZERO
+    daily_display = daily.quantize(_DAILY_PLACES) if daily else _ZERO
+
+    def _amounts(days: int, sell_days: int) -> dict:
+        d = max(0, int(days or 0))
+        s = max(0, int(sell_days or 0))
+        vacation_pay = (daily * d).quantize(_CENT)
+        vacation_one_third = (vacation_pay / 3).quantize(_CENT)
+        abono_pay = (daily * s).quantize(_CENT)
+        abono_one_third = (abono_pay / 3).quantize(_CENT)
+        gross_total = (vacation_pay + vacation_one_third + abono_pay + abono_one_third).quantize(_CENT)
+        return {
+            "daily": daily_display,
+            "vacation_pay": vacation_pay,
+            "vacation_one_third": vacation_one_third,
+            "abono_pay": abono_pay,
+            "abono_one_third": abono_one_third,
+            "gross_total": gross_total,
+        }
 
+    return _amounts
 
-def _calc_vacations_month_summary(year: int, month: int) -> dict:
-    rows = EmployeeVacation.query.filter_by(year=int(year), month=int(month)).all()
-    total = Decimal("0")
-    for r in rows:
-        try:
-            total += Decimal(str(r.gross_total or 0))
-        except Exception:
-            total += Decimal("0")
-    total = total.quantize(Decimal("0.01"))
+
+def _calc_vacation_amounts(base_salary: Decimal, days: int, sell_days: int) -> dict:
+    return _vacation_calculator(base_salary)(days, sell_days)
+
+
+def _calc_all_month_summaries(year: int, month: int) -> dict[str, dict]:
+    """Resumos de receitas, férias, 13º, rescisões e afastamentos da competência (e a contagem de funcionários) num único SELECT.
+
+    Cada tabela vira um par de subconsultas escalares (COUNT e COALESCE(SUM)), então o banco
+    responde tudo numa ida só, tanto no SQLite quanto no Postgres. Junto vêm, como EXISTS, a
+    presença de folha, fechamento e de cada guia (o guia mensal só precisa saber se existem).
+    """
+    y, m = int(year), int(month)
+
+    def _count(model, *criteria):
+        return db.session.query(func.count(model.id)).filter(*criteria).scalar_subquery()
+
+    def _sum(column, *criteria):
+        return db.session.query(func.coalesce(func.sum(column), 0)).filter(*criteria).scalar_subquery()
+
+    def _exists(model, *criteria):
+        return db.session.query(model.id).filter(*criteria).exists()
+
+    rev = (RevenueNote.year == y, RevenueNote.month == m)
+    vac = (EmployeeVacation.year == y, EmployeeVacation.month == m)
+    thr = (EmployeeThirteenth.payment_year == y, EmployeeThirteenth.payment_month == m)
+    ter = (EmployeeTermination.year == y, EmployeeTermination.month == m)
+    lea = (EmployeeLeave.year == y, EmployeeLeave.month == m)
+    row = db.session.query(
+        _count(RevenueNote, *rev),
+        _sum(RevenueNote.amount, *rev),
+        _count(EmployeeVacation, *vac),
+        _sum(EmployeeVacation.gross_total, *vac),
+        _count(EmployeeThirteenth, *thr),
+        _sum(EmployeeThirteenth.gross_amount, *thr),
+        _count(EmployeeTermination, *ter),
+        _sum(EmployeeTermination.gross_total, *ter),
+        _count(EmployeeLeave, *lea),
+        _count(Employee),
+        _count(Employee, Employee.active.is_(True)),
+        _exists(PayrollRun, PayrollRun.year == y, PayrollRun.month == m),
+        _exists(CompetenceClose, CompetenceClose.year == y, CompetenceClose.month == m),
+        *(
+            _exists(GuideDocument, GuideDocument.year == y, GuideDocument.month == m, GuideDocument.doc_type == doc_type)
+            for doc_type in _GUIDE_DOC_TYPES_ORDER
+        ),
+    ).one()
+    rev_count, rev_total, vac_count, vac_total, thr_count, thr_total, ter_count, ter_total, lea_count, emp_count, emp_active = row[:11]
+    has_run, has_close, *has_guides = row[11:]
     return {
-        "count": len(rows),
-        "total_gross": total,
+        "presence": {
+            "run": bool(has_run),
+            "closed": bool(has_close),
+            "guides": {doc_type: bool(v) for doc_type, v in zip(_GUIDE_DOC_TYPES_ORDER, has_guides)},
+        },
+        "employees": {"count": int(emp_count or 0), "active_count": int(emp_active or 0)},
+        "revenue": {"count": int(rev_count or 0), "total": Decimal(rev_total or 0).quantize(_CENT)},
+        "vacations": {"count": int(vac_count or 0), "total_gross": Decimal(vac_total or 0).quantize(_CENT)},
+        "thirteenth": {"count": int(thr_count or 0), "total_gross": Decimal(thr_total or 0).quantize(_CENT)},
+        "terminations": {"count": int(ter_count or 0), "total_gross": Decimal(ter_total or 0).quantize(_CENT)},
+        "leaves": {"count": int(lea_count or 0)},
     }
 
 
-def _calc_terminations_month_summary(year: int, month: int) -> dict:
-    rows = EmployeeTermination.query.filter_by(year=int(year), month=int(month)).all()
-    total = Decimal("0")
-    for r in rows:
-        try:
-            total += Decimal(str(r.gross_total or 0))
-        except Exception:
-            total += Decimal("0")
-    total = total.quantize(Decimal("0.01"))
-    return {
-        "count": len(rows),
-        "total_gross": total,
-    }
+def _guide_documents_for(year: int, month: int) -> dict[str, GuideDocument | None]:
+    """Guias DARF/DAS/FGTS da competência numa única consulta (ausentes ficam como None)."""
+    rows = GuideDocument.query.filter(
+        GuideDocument.year == int(year),
+        GuideDocument.month == int(month),
+        GuideDocument.doc_type.in_(_VALID_GUIDE_DOC_TYPES),
+    ).all()
+    return _guide_documents_by_type(rows)
 
 
-def _calc_leaves_month_summary(year: int, month: int) -> dict:
-    rows = EmployeeLeave.query.filter_by(year=int(year), month=int(month)).all()
-    return {
-        "count": len(rows),
+def _guide_documents_by_type(rows) -> dict[str, GuideDocument | None]:
+    docs: dict[str, GuideDocument | None] = {doc_type: None for doc_type in _GUIDE_DOC_TYPES_ORDER}
+    for row in rows:
+        if row.doc_type in docs and docs[row.doc_type] is None:
+            docs[row.doc_type] = row
+    return docs
+
+
+def _load_close_context(year: int, month: int, *, with_summaries: bool = False) -> dict:
+    """Dados da competência usados pelo guia mensal e pelo fechamento (folha, tabelas, guias, resumos)."""
+    tables = _tax_tables_for(_competence_start(int(year), int(month)))
+    # Com folha criada, fechamento e guias vêm junto dela (JOIN + um SELECT ... IN); sem folha, consultas diretas.
+    run = (
+        PayrollRun.query.options(joinedload(PayrollRun.competence_close), selectinload(PayrollRun.guide_documents))
+        .filter_by(year=year, month=month)
+        .first()
+    )
+    if run is not None:
+        closed = run.competence_close
+        docs = _guide_documents_by_type(run.guide_documents)
+    else:
+        closed = CompetenceClose.query.filter_by(year=year, month=month).first()
+        docs = _guide_documents_for(year, month)
+    ctx = {
+        "run": run,
+        "closed": closed,
+        "inss_eff": tables["inss_eff"],
+        "inss_rows": tables["inss_rows"],
+        "irrf_cfg": tables["irrf_cfg"],
+        "irrf_eff": tables["irrf_eff"],
+        "irrf_rows": tables["irrf_rows"],
+        "docs": docs,
     }
+    if with_summaries:
+        summaries = _calc_all_month_summaries(year, month)
+        ctx["revenue_summary"] = summaries["revenue"]
+        ctx["vacations_summary"] = summaries["vacations"]
+        ctx["thirteenth_summary"] = summaries["thirteenth"]
+        ctx["terminations_summary"] = summaries["terminations"]
+        ctx["leaves_summary"] = summaries["leaves"]
+        ctx["employees_count"] = summaries["employees"]["count"]
+        ctx["active_employees_count"] = summaries["employees"]["active_count"]
+    else:
+        ctx["revenue_summary"] = _calc_revenue_month_summary(year, month)
+    return ctx
 
 
 def _salary_for_employee(employee: Employee, year: int, month: int) -> Decimal:
+    # Memoizado por requisição: o mesmo funcionário/competência é consultado pelo cálculo e pelos recibos.
+    cache = g.get("_salary_cache")
+    if cache is None:
+        cache = {}
+        g._salary_cache = cache
+    key = (employee.id, int(year), int(month))
+    if key not in cache:
+        cache[key] = _query_salary_for_employee(employee, year, month)
+    return cache[key]
+
+
+def _query_salary_for_employee(employee: Employee, year: int, month: int) -> Decimal:
     comp = _competence_start(year, month)
     s = (
         EmployeeSalary.query.filter(EmployeeSalary.employee_id == employee.id)
@@ -2120,96 +2451,283 @@ def _salary_for_employee(employee: Employee, year: int, month: int) -> Decimal:
         .first()
     )
     if not s:
-        return Decimal("0")
+        return _ZERO
+    return s.base_salary or _ZERO
+
+
+def _salaries_for_employees(employee_ids: list[int], year: int, month: int) -> dict[int, Decimal]:
+    """Salário vigente na competência para vários funcionários, em uma única consulta."""
+    if not employee_ids:
+        return {}
+    comp = _competence_start(year, month)
+    ranked = (
+        db.session.query(
+            EmployeeSalary.employee_id.label("employee_id"),
+            EmployeeSalary.base_salary.label("base_salary"),
+            func.row_number()
+            .over(partition_by=EmployeeSalary.employee_id, order_by=EmployeeSalary.effective_from.desc())
+            .label("rn"),
+        )
+        .filter(EmployeeSalary.employee_id.in_(employee_ids))
+        .filter(EmployeeSalary.effective_from <= comp)
+        .subquery()
+    )
+    rows = db.session.query(ranked.c.employee_id, ranked.c.base_salary).filter(ranked.c.rn == 1).all()
+    return {employee_id: base_salary for employee_id, base_salary in rows if base_salary is not None}
+
+
+# Linhas materializadas (imutáveis) das tabelas fiscais: podem ser reaproveitadas entre requisições
+# sem depender da sessão do SQLAlchemy.
+_InssBracketRow = namedtuple("_InssBracketRow", "effective_from up_to rate")
+_IrrfBracketRow = namedtuple("_IrrfBracketRow", "effective_from up_to rate deduction")
+_IrrfConfigRow = namedtuple("_IrrfConfigRow", "effective_from dependent_deduction")
+
+
+def _env_seconds(name: str, default: int) -> int:
     try:
-        return Decimal(str(s.base_salary))
-    except Exception:
-        return Decimal("0")
+        value = int(str(os.getenv(name) or default).strip())
+    except ValueError:
+        return default
+    return max(0, value)
 
 
-def _latest_inss_brackets(effective_date: date):
-    eff = (
-        db.session.query(TaxInssBracket.effective_from)
+# Cache por processo das tabelas INSS/IRRF por vigência. As tabelas mudam poucas vezes por ano e as
+# gravações feitas por este processo limpam o cache na hora; o TTL (TAX_TABLES_CACHE_TTL_SECONDS, 0 desativa)
+# limita o atraso quando outra instância (ou `flask sync-taxes --apply`) grava tabelas novas.
+_TAX_TABLES_TTL_SECONDS = _env_seconds("TAX_TABLES_CACHE_TTL_SECONDS", 60)
+_TAX_TABLES_MAX_ENTRIES = 256
+_tax_tables_snapshots: dict = {}
+
+
+def _query_latest_inss_brackets(effective_date: date):
+    latest_eff = (
+        db.session.query(func.max(TaxInssBracket.effective_from))
         .filter(TaxInssBracket.effective_from <= effective_date)
-        .order_by(TaxInssBracket.effective_from.desc())
-        .limit(1)
-        .scalar()
+        .scalar_subquery()
     )
-    if not eff:
-        return None, []
-    rows = TaxInssBracket.query.filter_by(effective_from=eff).order_by(TaxInssBracket.up_to.asc().nullslast()).all()
-    return eff, rows
+    rows = (
+        TaxInssBracket.query.filter(TaxInssBracket.effective_from == latest_eff)
+        .order_by(TaxInssBracket.up_to.asc().nullslast())
+        .all()
+    )
+    if not rows:
+        return None, ()
+    return rows[0].effective_from, tuple(_InssBracketRow(r.effective_from, r.up_to, r.rate) for r in rows)
 
 
-def _latest_irrf_config(effective_date: date):
-    return (
+def _query_latest_irrf_config(effective_date: date):
+    cfg = (
         TaxIrrfConfig.query.filter(TaxIrrfConfig.effective_from <= effective_date)
         .order_by(TaxIrrfConfig.effective_from.desc())
         .first()
     )
+    if not cfg:
+        return None
+    return _IrrfConfigRow(cfg.effective_from, Decimal(cfg.dependent_deduction or 0))
 
 
-def _latest_irrf_brackets(effective_date: date):
-    eff = (
-        db.session.query(TaxIrrfBracket.effective_from)
+def _query_latest_irrf_brackets(effective_date: date):
+    latest_eff = (
+        db.session.query(func.max(TaxIrrfBracket.effective_from))
         .filter(TaxIrrfBracket.effective_from <= effective_date)
-        .order_by(TaxIrrfBracket.effective_from.desc())
-        .limit(1)
-        .scalar()
+        .scalar_subquery()
     )
-    if not eff:
-        return None, []
-    rows = TaxIrrfBracket.query.filter_by(effective_from=eff).order_by(TaxIrrfBracket.up_to.asc().nullslast()).all()
-    return eff, rows
+    rows = (
+        TaxIrrfBracket.query.filter(TaxIrrfBracket.effective_from == latest_eff)
+        .order_by(TaxIrrfBracket.up_to.asc().nullslast())
+        .all()
+    )
+    if not rows:
+        return None, ()
+    return rows[0].effective_from, tuple(_IrrfBracketRow(r.effective_from, r.up_to, r.rate, r.deduction) for r in rows)
 
 
-def _calc_inss_progressive(base: Decimal, brackets: list[TaxInssBracket]) -> Decimal:
-    if base <= 0:
-        return Decimal("0")
-    remaining = base
-    prev = Decimal("0")
-    total = Decimal("0")
+def _tax_tables_cache() -> dict:
+    # Cache por requisição: as tabelas INSS/IRRF não mudam durante uma requisição de leitura,
+    # mas várias telas (fechamento, holerite, férias) consultam a mesma competência mais de uma vez.
+    cache = g.get("_tax_tables_cache")
+    if cache is None:
+        cache = {}
+        g._tax_tables_cache = cache
+    return cache
+
+
+def _clear_tax_tables_cache() -> None:
+    g.pop("_tax_tables_cache", None)
+    _tax_tables_snapshots.clear()
+
+
+def _cached_tax_lookup(kind: str, effective_date: date, loader):
+    cache = _tax_tables_cache()
+    key = (kind, effective_date)
+    if key in cache:
+        return cache[key]
+
+    now = time.monotonic()
+    hit = _tax_tables_snapshots.get(key)
+    if hit is not None and now - hit[0] < _TAX_TABLES_TTL_SECONDS:
+        value = hit[1]
+    else:
+        value = loader(effective_date)
+        if len(_tax_tables_snapshots) >= _TAX_TABLES_MAX_ENTRIES:
+            _tax_tables_snapshots.clear()
+        _tax_tables_snapshots[key] = (now, value)
+    cache[key] = value
+    return value
+
+
+def _latest_inss_brackets(effective_date: date):
+    return _cached_tax_lookup("inss", effective_date, _query_latest_inss_brackets)
+
+
+def _latest_irrf_config(effective_date: date):
+    return _cached_tax_lookup("irrf_cfg", effective_date, _query_latest_irrf_config)
+
+
+def _latest_irrf_brackets(effective_date: date):
+    return _cached_tax_lookup("irrf", effective_date, _query_latest_irrf_brackets)
+
+
+def _tax_tables_digest(inss_rows: tuple, irrf_cfg: _IrrfConfigRow | None, irrf_rows: tuple) -> str:
+    # Versão do conteúdo das tabelas, não só da vigência: faixas incluídas/alteradas na mesma vigência,
+    # dedução por dependente e `sync-taxes --apply` (que regrava as linhas) mudam o digest.
+    def _part(value) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, Decimal):
+            return str(value.normalize())
+        if isinstance(value, date):
+            return value.isoformat()
+        return str(value)
+
+    rows = (("inss",) + tuple(r) for r in inss_rows)
+    cfg = (("irrf_cfg",) + tuple(irrf_cfg),) if irrf_cfg else ()
+    irrf = (("irrf",) + tuple(r) for r in irrf_rows)
+    payload = "\n".join("|".join(_part(v) for v in row) for group in (rows, cfg, irrf) for row in group)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _tax_tables_for(comp: date) -> dict:
+    """Tabelas INSS/IRRF vigentes na competência, com o indicador `has_tables` já calculado."""
+    cache = _tax_tables_cache()
+    key = ("bundle", comp)
+    if key not in cache:
+        inss_eff, inss_rows = _latest_inss_brackets(comp)
+        irrf_cfg = _latest_irrf_config(comp)
+        irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
+        cache[key] = {
+            "inss_eff": inss_eff,
+            "inss_rows": inss_rows,
+            "irrf_cfg": irrf_cfg,
+            "irrf_eff": irrf_eff,
+            "irrf_rows": irrf_rows,
+            "has_tables": bool(inss_rows) and bool(irrf_rows) and bool(irrf_cfg),
+            "digest": _tax_tables_digest(inss_rows, irrf_cfg, irrf_rows),
+        }
+    return cache[key]
+
+
+def _bracket_calculator(kind: str, brackets: tuple, build):
+    # As faixas carregadas do banco são as mesmas durante a requisição; a conversão para
+    # Decimal e o filtro das faixas ficam prontos numa função reaproveitada (ver _tax_tables_cache).
+    cache = _tax_tables_cache()
+    key = (kind, id(brackets))
+    hit = cache.get(key)
+    if hit is not None and hit[0] is brackets:
+        return hit[1]
+    fn = build(brackets)
+    cache[key] = (brackets, fn)
+    return fn
+
+
+_RATE_SCALE = 1_000_000  # alíquotas são Numeric(8, 6): 0,075 -> 75000 milionésimos
+
+
+def _to_cents(v: Decimal) -> int:
+    return int((Decimal(v) * 100).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def _from_scaled(units: int, places: int) -> Decimal:
+    # Converte um inteiro em 10^-places reais de volta para Decimal, arredondando para centavos.
+    return Decimal(units).scaleb(-places).quantize(_CENT)
+
+
+def _build_inss_calculator(brackets: tuple[_InssBracketRow, ...]):
+    # Conta feita em inteiros: valores em centavos e alíquota em milionésimos.
+    params = []
     for b in brackets:
-        up_to = Decimal(str(b.up_to)) if b.up_to is not None else None
-        rate = Decimal(str(b.rate or 0))
+        rate = int((Decimal(b.rate or 0) * _RATE_SCALE).to_integral_value())
         if rate <= 0:
             continue
-        if up_to is None:
-            taxable = max(Decimal("0"), remaining)
-        else:
-            taxable = max(Decimal("0"), min(base, up_to) - prev)
-        if taxable > 0:
-            total += (taxable * rate)
-        if up_to is not None:
-            prev = up_to
-        if base <= prev:
-            break
-    return total.quantize(Decimal("0.01"))
+        params.append((_to_cents(b.up_to) if b.up_to is not None else None, rate))
+    params = tuple(params)
+
+    def _inss(base: Decimal) -> Decimal:
+        if base <= 0:
+            return _ZERO
+        base_c = _to_cents(base)
+        prev = 0
+        total = 0
+        for up_to, rate in params:
+            if up_to is None:
+                taxable = max(0, base_c)
+            else:
+                taxable = max(0, min(base_c, up_to) - prev)
+            if taxable > 0:
+                total += taxable * rate
+            if up_to is not None:
+                prev = up_to
+            if base_c <= prev:
+                break
+        return _from_scaled(total, 8)
+
+    return _inss
+
+
+def _build_irrf_calculator(brackets: tuple[_IrrfBracketRow, ...]):
+    params = tuple(
+        (
+            _to_cents(b.up_to) if b.up_to is not None else None,
+            int((Decimal(b.rate or 0) * _RATE_SCALE).to_integral_value()),
+            _to_cents(b.deduction or 0) * _RATE_SCALE,
+        )
+        for b in brackets
+    )
+
+    # Faixa isenta (alíquota 0 e nada a deduzir): bases até esse teto não precisam percorrer as faixas.
+    exempt_ceiling = None
+    if params and params[0][0] is not None and params[0][1] == 0 and params[0][2] == 0:
+        exempt_ceiling = params[0][0]
+    exempt_value = _ZERO.quantize(_CENT)
+
+    def _irrf(calc_base: Decimal) -> Decimal:
+        # IRRF (mensal) tipicamente é por faixa com "parcela a deduzir" (não progressivo no cálculo final).
+        base_c = _to_cents(calc_base)
+        if exempt_ceiling is not None and base_c <= exempt_ceiling:
+            return exempt_value
+        for up_to, rate, ded in params:
+            if up_to is None or base_c <= up_to:
+                return _from_scaled(max(0, base_c * rate - ded), 8)
+        return _ZERO
+
+    return _irrf
+
 
+def _calc_inss_progressive(base: Decimal, brackets: tuple[_InssBracketRow, ...]) -> Decimal:
+    return _bracket_calculator("inss_fn", brackets, _build_inss_calculator)(base)
 
-def _calc_irrf(base: Decimal, cfg: TaxIrrfConfig | None, brackets: list[TaxIrrfBracket], dependents_count: int) -> Decimal:
+
+def _calc_irrf(
+    base: Decimal, cfg: _IrrfConfigRow | None, brackets: tuple[_IrrfBracketRow, ...], dependents_count: int
+) -> Decimal:
     if base <= 0:
-        return Decimal("0")
-    dep_ded = Decimal(str(getattr(cfg, "dependent_deduction", 0) or 0)) if cfg else Decimal("0")
-    calc_base = base - (dep_ded * Decimal(str(dependents_count or 0)))
+        return _ZERO
+    # dependent_deduction já vem como Decimal do cache das tabelas; Decimal * int é exato.
+    dep_ded = cfg.dependent_deduction if cfg else _ZERO
+    calc_base = base - (dep_ded * int(dependents_count or 0))
     if calc_base <= 0:
-        return Decimal("0")
-
-    # IRRF (mensal) tipicamente é por faixa com "parcela a deduzir" (não progressivo no cálculo final).
-    chosen = None
-    for b in brackets:
-        up_to = Decimal(str(b.up_to)) if b.up_to is not None else None
-        if up_to is None or calc_base <= up_to:
-            chosen = b
-            break
-    if not chosen:
-        return Decimal("0")
-    rate = Decimal(str(chosen.rate or 0))
-    ded = Decimal(str(chosen.deduction or 0))
-    val = (calc_base * rate) - ded
-    if val < 0:
-        val = Decimal("0")
-    return val.quantize(Decimal("0.01"))
+        return _ZERO
+    return _bracket_calculator("irrf_fn", brackets, _build_irrf_calculator)(calc_base)
 
 
 def _calc_month_summary(run: PayrollRun | None) -> dict | None:
@@ -2217,35 +2735,39 @@ def _calc_month_summary(run: PayrollRun | None) -> dict | None:
         return None
 
     comp = date(int(run.year), int(run.month), 1)
-    lines = PayrollLine.query.filter_by(payroll_run_id=run.id).all()
+    # Só bruto e dependentes (contador desnormalizado) entram na conta: projeção com JOIN, sem montar objetos ORM.
+    lines = (
+        db.session.query(PayrollLine.gross_total, Employee.dependents_count)
+        .join(Employee, PayrollLine.employee_id == Employee.id)
+        .filter(PayrollLine.payroll_run_id == run.id)
+        .all()
+    )
 
-    total_gross = Decimal("0")
-    total_inss = Decimal("0")
-    total_irrf = Decimal("0")
+    total_gross = _ZERO
+    total_inss = _ZERO
+    total_irrf = _ZERO
 
     inss_eff, inss_rows = _latest_inss_brackets(comp)
     irrf_cfg = _latest_irrf_config(comp)
     irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
+    # As calculadoras (faixas já convertidas para inteiros) são obtidas uma vez, fora do laço por linha.
+    inss_fn = _bracket_calculator("inss_fn", inss_rows, _build_inss_calculator) if inss_rows else None
+    has_irrf = bool(irrf_rows and irrf_cfg)
 
-    for ln in lines:
-        gross = (Decimal(str(ln.gross_total or 0)) if ln.gross_total is not None else Decimal("0"))
+    for gross, deps_count in lines:
+        gross = gross if gross is not None else _ZERO
         total_gross += gross
 
-        deps_count = EmployeeDependent.query.filter_by(employee_id=ln.employee_id).count()
-        inss_est = Decimal("0")
-        if inss_rows:
-            inss_est = _calc_inss_progressive(gross, inss_rows)
+        inss_est = inss_fn(gross) if inss_fn else _ZERO
         total_inss += inss_est
 
-        irrf_est = Decimal("0")
-        if irrf_rows and irrf_cfg:
-            irrf_est = _calc_irrf(gross - inss_est, irrf_cfg, irrf_rows, deps_count)
-        total_irrf += irrf_est
+        if has_irrf:
+            total_irrf += _calc_irrf(gross - inss_est, irrf_cfg, irrf_rows, deps_count)
 
-    total_gross = total_gross.quantize(Decimal("0.01"))
-    total_inss = total_inss.quantize(Decimal("0.01"))
-    total_irrf = total_irrf.quantize(Decimal("0.01"))
-    total_net = (total_gross - total_inss - total_irrf).quantize(Decimal("0.01"))
+    total_gross = total_gross.quantize(_CENT)
+    total_inss = total_inss.quantize(_CENT)
+    total_irrf = total_irrf.quantize(_CENT)
+    total_net = (total_gross - total_inss - total_irrf).quantize(_CENT)
 
     return {
         "year": int(run.year),
@@ -2265,7 +2787,8 @@ def _calc_month_summary(run: PayrollRun | None) -> dict | None:
 @login_required
 def employees():
     items = Employee.query.order_by(Employee.active.desc(), Employee.full_name.asc()).all()
-    return render_template("payroll/employees.html", items=items)
+    now = _request_now()
+    return render_template("payroll/employees.html", items=items, now_year=now.year, now_month=now.month)
 
 
 @payroll_bp.post("/employees")
@@ -2356,7 +2879,7 @@ def employee_update_profile(employee_id: int):
 @login_required
 def employee_vacations(employee_id: int):
     e = Employee.query.get_or_404(employee_id)
-    now = datetime.now()
+    now = _request_now()
     year = int(request.args.get("year") or now.year)
     month = int(request.args.get("month") or now.month)
     rows = EmployeeVacation.query.filter_by(employee_id=e.id).order_by(EmployeeVacation.year.desc(), EmployeeVacation.month.desc(), EmployeeVacation.start_date.desc()).all()
@@ -2369,56 +2892,64 @@ def employee_vacations(employee_id: int):
     )
 
 
-@payroll_bp.post("/employees/<int:employee_id>/vacations")
-@login_required
-def employee_vacations_add(employee_id: int):
-    e = Employee.query.get_or_404(employee_id)
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
-    start_date = _parse_date(request.form.get("start_date"))
-    pay_date = _parse_date(request.form.get("pay_date"))
-    days = int(request.form.get("days") or 0)
-    sell_days = int(request.form.get("sell_days") or 0)
-
-    if year < 2000 or month < 1 or month > 12:
-        flash("Competência inválida.", "warning")
-        return redirect(url_for("payroll.employee_vacations", employee_id=e.id))
+def _vacation_form_error(year: int, month: int, start_date: date | None, days: int, sell_days: int) -> str | None:
+    if not _valid_competence(year, month):
+        return "Competência inválida."
     if not start_date:
-        flash("Informe a data de início das férias.", "warning")
-        return redirect(url_for("payroll.employee_vacations", employee_id=e.id, year=year, month=month))
-
+        return "Informe a data de início das férias."
     if days <= 0 or days > 30:
-        flash("Dias de gozo inválidos (1 a 30).", "warning")
-        return redirect(url_for("payroll.employee_vacations", employee_id=e.id, year=year, month=month))
+        return "Dias de gozo inválidos (1 a 30)."
     if sell_days < 0 or sell_days > 10:
-        flash("Dias vendidos inválidos (0 a 10).", "warning")
-        return redirect(url_for("payroll.employee_vacations", employee_id=e.id, year=year, month=month))
+        return "Dias vendidos inválidos (0 a 10)."
     if days + sell_days > 30:
-        flash("Gozo + venda não pode ultrapassar 30 dias.", "warning")
-        return redirect(url_for("payroll.employee_vacations", employee_id=e.id, year=year, month=month))
+        return "Gozo + venda não pode ultrapassar 30 dias."
+    return None
 
-    base_salary = _salary_for_employee(e, year, month)
-    amounts = _calc_vacation_amounts(base_salary, days, sell_days)
 
+def _vacation_estimates(e: Employee, year: int, month: int, gross: Decimal) -> dict:
     # Estimate discounts using the same tax tables (didactic, not official).
-    comp = _competence_start(year, month)
-    deps_count = EmployeeDependent.query.filter_by(employee_id=e.id).count()
-    inss_eff, inss_rows = _latest_inss_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
+    # Read-only lookups: no need to flush pending rows (e.g. the recalc loop) before each SELECT.
+    with db.session.no_autoflush:
+        deps_count = e.dependents_count
+        tables = _tax_tables_for(_competence_start(year, month))
+    inss_eff, inss_rows = tables["inss_eff"], tables["inss_rows"]
+    irrf_cfg = tables["irrf_cfg"]
+    irrf_eff, irrf_rows = tables["irrf_eff"], tables["irrf_rows"]
 
     inss_est = None
     irrf_est = None
     net_est = None
-    gross = amounts["gross_total"]
     if inss_rows:
         inss_est = _calc_inss_progressive(gross, inss_rows)
     if irrf_rows and irrf_cfg and inss_est is not None:
         irrf_est = _calc_irrf(gross - inss_est, irrf_cfg, irrf_rows, deps_count)
     if inss_est is not None and irrf_est is not None:
-        net_est = (gross - inss_est - irrf_est).quantize(Decimal("0.01"))
+        net_est = (gross - inss_est - irrf_est).quantize(_CENT)
+
+    return {
+        "inss_est": inss_est,
+        "irrf_est": irrf_est,
+        "net_est": net_est,
+        "inss_table_from": inss_eff if inss_est is not None else None,
+        "irrf_table_from": irrf_eff if irrf_est is not None else None,
+        "tax_tables_digest": tables["digest"] if net_est is not None else None,
+    }
+
+
+def _build_vacation_row(
+    e: Employee,
+    year: int,
+    month: int,
+    start_date: date,
+    pay_date: date | None,
+    days: int,
+    sell_days: int,
+    base_salary: Decimal,
+) -> EmployeeVacation:
+    amounts = _calc_vacation_amounts(base_salary, days, sell_days)
+    estimates = _vacation_estimates(e, year, month, amounts["gross_total"])
 
-    row = EmployeeVacation(
+    return EmployeeVacation(
         employee_id=e.id,
         year=year,
         month=month,
@@ -2432,33 +2963,162 @@ def employee_vacations_add(employee_id: int):
         abono_pay=amounts["abono_pay"],
         abono_one_third=amounts["abono_one_third"],
         gross_total=amounts["gross_total"],
-        inss_est=(inss_est if inss_est is not None else None),
-        irrf_est=(irrf_est if irrf_est is not None else None),
-        net_est=(net_est if net_est is not None else None),
+        **estimates,
     )
+
+
+def _vacation_estimates_stale(v: EmployeeVacation, tables: dict) -> bool:
+    # Compara o conteúdo das tabelas (digest), não só a vigência: correções na mesma vigência também contam.
+    return tables["has_tables"] and v.tax_tables_digest != tables["digest"]
+
+
+@payroll_bp.post("/employees/<int:employee_id>/vacations")
+@login_required
+def employee_vacations_add(employee_id: int):
+    year, month = _form_competence()
+    start_date = _parse_date(request.form.get("start_date"))
+    pay_date = _parse_date(request.form.get("pay_date"))
+    days = int(request.form.get("days") or 0)
+    sell_days = int(request.form.get("sell_days") or 0)
+
+    valid_competence = _valid_competence(year, month)
+    if valid_competence:
+        list_url = url_for("payroll.employee_vacations", employee_id=employee_id, year=year, month=month)
+    else:
+        list_url = url_for("payroll.employee_vacations", employee_id=employee_id)
+
+    # Validação só com os dados do formulário: formulários inválidos voltam sem nenhuma consulta ao banco.
+    error = _vacation_form_error(year, month, start_date, days, sell_days)
+    if error:
+        flash(error, "warning")
+        return redirect(list_url)
+
+    e = Employee.query.get_or_404(employee_id)
+    base_salary = _salary_for_employee(e, year, month)
+    row = _build_vacation_row(e, year, month, start_date, pay_date, days, sell_days, base_salary)
     db.session.add(row)
     db.session.commit()
     flash("Férias registradas.", "success")
-    return redirect(url_for("payroll.employee_vacations", employee_id=e.id, year=year, month=month))
+    return redirect(list_url)
 
 
-@payroll_bp.get("/vacations/<int:vac_id>/receipt")
+@payroll_bp.post("/vacations/bulk")
 @login_required
-def vacation_receipt(vac_id: int):
-    v = EmployeeVacation.query.get_or_404(vac_id)
+def vacations_bulk_add():
+    year, month = _form_competence()
+    start_date = _parse_date(request.form.get("start_date"))
+    pay_date = _parse_date(request.form.get("pay_date"))
+    days = _form_int("days")
+    sell_days = _form_int("sell_days")
+    employee_ids = sorted({int(v) for v in request.form.getlist("employee_ids") if str(v).isdigit()})
 
-    comp = _competence_start(int(v.year), int(v.month))
-    inss_eff, inss_rows = _latest_inss_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
+    if not employee_ids:
+        flash("Selecione pelo menos um funcionário para as férias coletivas.", "warning")
+        return redirect(url_for("payroll.employees"))
+    error = _vacation_form_error(year, month, start_date, days, sell_days)
+    if error:
+        flash(error, "warning")
+        return redirect(url_for("payroll.employees"))
+
+    employees = Employee.query.filter(Employee.id.in_(employee_ids), Employee.active.is_(True)).all()
+    skipped = len(employee_ids) - len(employees)
+    if not employees:
+        flash("Nenhum funcionário ativo entre os selecionados; férias coletivas não registradas.", "warning")
+        return redirect(url_for("payroll.employees"))
+    salaries = _salaries_for_employees([e.id for e in employees], year, month)
+
+    rows = [
+        _build_vacation_row(e, year, month, start_date, pay_date, days, sell_days, salaries.get(e.id, _ZERO))
+        for e in employees
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    msg = f"Férias coletivas registradas para {len(rows)} funcionário(s)."
+    if skipped:
+        msg += f" {skipped} funcionário(s) ignorado(s) por não existirem ou estarem inativos."
+    flash(msg, "success")
+    return redirect(url_for("payroll.employees"))
+
+
+@payroll_bp.get("/vacations/<int:vac_id>/receipt")
+@login_required
+def vacation_receipt(vac_id: int):
+    v = EmployeeVacation.query.options(joinedload(EmployeeVacation.employee)).filter_by(id=vac_id).first_or_404()
 
+    tables = _tax_tables_for(_competence_start(int(v.year), int(v.month)))
     return render_template(
         "payroll/vacation_receipt.html",
         v=v,
         employee=v.employee,
-        inss_eff=inss_eff,
-        irrf_eff=irrf_eff,
-        has_tables=bool(inss_rows) and bool(irrf_rows) and bool(irrf_cfg),
+        inss_eff=tables["inss_eff"],
+        irrf_eff=tables["irrf_eff"],
+        has_tables=tables["has_tables"],
+        estimates_stale=_vacation_estimates_stale(v, tables),
+    )
+
+
+@payroll_bp.post("/vacations/<int:vac_id>/recalc")
+@login_required
+def vacation_recalc_estimates(vac_id: int):
+    v = EmployeeVacation.query.options(joinedload(EmployeeVacation.employee)).filter_by(id=vac_id).first_or_404()
+    year = int(v.year)
+    month = int(v.month)
+    receipt_url = url_for("payroll.vacation_receipt", vac_id=v.id)
+
+    tables = _tax_tables_for(_competence_start(year, month))
+    if not tables["has_tables"]:
+        # Sem tabelas o recálculo gravaria estimativas vazias por cima das salvas.
+        flash("Estimativas de INSS/IRRF mantidas: configure as tabelas da competência em Config INSS/IRRF.", "warning")
+        return redirect(receipt_url)
+    if not _vacation_estimates_stale(v, tables):
+        flash("Estimativas de INSS/IRRF já estão atualizadas.", "info")
+        return redirect(receipt_url)
+
+    if _competence_is_closed(year, month):
+        flash(
+            "Atenção: esta competência está marcada como FECHADA. As estimativas serão atualizadas, mas revise os relatórios/guias para manter tudo consistente.",
+            "warning",
+        )
+    for field, value in _vacation_estimates(v.employee, year, month, v.gross_total).items():
+        setattr(v, field, value)
+    db.session.commit()
+
+    flash("Estimativas de INSS/IRRF atualizadas.", "success")
+    return redirect(receipt_url)
+
+
+@payroll_bp.get("/employees/<int:employee_id>/vacations/receipts")
+@login_required
+def vacation_receipts_bulk(employee_id: int):
+    e = Employee.query.get_or_404(employee_id)
+    year = _arg_int("year", _request_now().year)
+
+    # Todas as férias são do mesmo funcionário (já carregado em e): sem joinedload do employee.
+    vacations = (
+        EmployeeVacation.query.filter_by(employee_id=e.id, year=year)
+        .order_by(EmployeeVacation.month.asc(), EmployeeVacation.start_date.asc())
+        .all()
+    )
+
+    # Tabelas INSS/IRRF são buscadas uma vez por competência (cache da requisição).
+    receipts = []
+    for v in vacations:
+        tables = _tax_tables_for(_competence_start(int(v.year), int(v.month)))
+        receipts.append(
+            {
+                "v": v,
+                "inss_eff": tables["inss_eff"],
+                "irrf_eff": tables["irrf_eff"],
+                "has_tables": tables["has_tables"],
+                "estimates_stale": _vacation_estimates_stale(v, tables),
+            }
+        )
+
+    return render_template(
+        "payroll/vacation_receipts.html",
+        employee=e,
+        year=year,
+        receipts=receipts,
     )
 
 
@@ -2469,8 +3129,9 @@ def vacation_receipt(vac_id: int):
 def _calc_thirteenth_amount(base_salary: Decimal, months_worked: int) -> dict:
     """Cálculo CLT: (salário / 12) × meses trabalhados."""
     m = max(1, min(12, int(months_worked or 12)))
-    monthly_part = (base_salary / Decimal("12")).quantize(Decimal("0.01"))
-    gross = (monthly_part * Decimal(str(m))).quantize(Decimal("0.01"))
+    monthly_part = (base_salary / _TWELVE).quantize(_CENT)
+    # monthly_part já está em centavos: multiplicar por um inteiro mantém 2 casas, sem novo quantize.
+    gross = monthly_part * m
     return {
         "monthly_part": monthly_part,
         "months_worked": m,
@@ -2484,12 +3145,10 @@ def _termination_expected_fgts_rate(termination_type: str) -> Decimal:
         return Decimal("0.40")
     if t == "agreement":
         return Decimal("0.20")
-    return Decimal("0")
+    return _ZERO
 
 
-def _termination_guided_checklist(termination_type: str, notice_type: str) -> list[str]:
-    t = (termination_type or "").strip().lower()
-    n = (notice_type or "").strip().lower()
+def _build_termination_checklist(t: str, n: str) -> tuple[str, ...]:
     items: list[str] = [
         "Conferir saldo de salário e férias (vencidas/proporcionais + 1/3).",
         "Emitir TRCT e termo de quitação para assinatura.",
@@ -2509,23 +3168,24 @@ def _termination_guided_checklist(termination_type: str, notice_type: str) -> li
         items.append("Sem aviso indenizado e sem multa FGTS (justa causa).")
     elif t == "resignation":
         items.append("Pedido de demissão: validar aviso prévio conforme política aplicável.")
-    return items
+    return tuple(items)
 
 
-def _calc_thirteenth_month_summary(year: int, month: int) -> dict:
-    """Resumo de 13º registrados na competência."""
-    rows = EmployeeThirteenth.query.filter_by(payment_year=int(year), payment_month=int(month)).all()
-    total = Decimal("0")
-    for r in rows:
-        try:
-            total += Decimal(str(r.gross_amount or 0))
-        except Exception:
-            total += Decimal("0")
-    total = total.quantize(Decimal("0.01"))
-    return {
-        "count": len(rows),
-        "total_gross": total,
-    }
+_TERMINATION_TYPES = ("without_cause", "with_cause", "agreement", "resignation")
+_NOTICE_TYPES = ("none", "worked", "indemnified")
+# Todas as combinações do formulário são montadas uma vez na importação do módulo.
+_TERMINATION_CHECKLISTS = {
+    (t, n): _build_termination_checklist(t, n) for t in _TERMINATION_TYPES for n in _NOTICE_TYPES
+}
+
+
+def _termination_guided_checklist(termination_type: str, notice_type: str) -> list[str]:
+    t = (termination_type or "").strip().lower()
+    n = (notice_type or "").strip().lower()
+    items = _TERMINATION_CHECKLISTS.get((t, n))
+    if items is None:
+        items = _build_termination_checklist(t, n)
+    return list(items)
 
 
 @payroll_bp.get("/employees/<int:employee_id>/thirteenth")
@@ -2533,14 +3193,28 @@ def _calc_thirteenth_month_summary(year: int, month: int) -> dict:
 def employee_thirteenth(employee_id: int):
     """Tela de gestão do 13º salário por funcionário."""
     e = Employee.query.get_or_404(employee_id)
-    now = datetime.now()
+    now = _request_now()
     year = int(request.args.get("year") or now.year)
     month = int(request.args.get("month") or now.month)
-    rows = EmployeeThirteenth.query.filter_by(employee_id=e.id).order_by(
-        EmployeeThirteenth.reference_year.desc(),
-        EmployeeThirteenth.payment_year.desc(),
-        EmployeeThirteenth.payment_month.desc(),
-    ).all()
+    # Só as colunas exibidas na tabela: linhas leves em vez de instâncias ORM completas.
+    rows = (
+        db.session.query(
+            EmployeeThirteenth.id,
+            EmployeeThirteenth.reference_year,
+            EmployeeThirteenth.payment_year,
+            EmployeeThirteenth.payment_month,
+            EmployeeThirteenth.payment_type,
+            EmployeeThirteenth.months_worked,
+            EmployeeThirteenth.gross_amount,
+        )
+        .filter(EmployeeThirteenth.employee_id == e.id)
+        .order_by(
+            EmployeeThirteenth.reference_year.desc(),
+            EmployeeThirteenth.payment_year.desc(),
+            EmployeeThirteenth.payment_month.desc(),
+        )
+        .all()
+    )
     return render_template(
         "payroll/employee_thirteenth.html",
         e=e,
@@ -2550,11 +3224,20 @@ def employee_thirteenth(employee_id: int):
     )
 
 
+def _thirteenth_form_error(ref_year: int, pay_year: int, pay_month: int, payment_type: str, months_worked: int) -> str | None:
+    if ref_year < 2000 or not _valid_competence(pay_year, pay_month):
+        return "Datas inválidas."
+    if payment_type not in _VALID_THIRTEENTH_PAYMENT_TYPES:
+        return "Tipo de pagamento inválido."
+    if months_worked < 1 or months_worked > 12:
+        return "Meses trabalhados devem ser entre 1 e 12."
+    return None
+
+
 @payroll_bp.post("/employees/<int:employee_id>/thirteenth")
 @login_required
 def employee_thirteenth_add(employee_id: int):
     """Cadastra pagamento de 13º (1ª parcela, 2ª parcela ou integral)."""
-    e = Employee.query.get_or_404(employee_id)
     ref_year = int(request.form.get("reference_year") or 0)
     pay_year = int(request.form.get("payment_year") or 0)
     pay_month = int(request.form.get("payment_month") or 0)
@@ -2562,42 +3245,41 @@ def employee_thirteenth_add(employee_id: int):
     months_worked = int(request.form.get("months_worked") or 12)
     payment_type = (request.form.get("payment_type") or "").strip().lower()
 
-    if ref_year < 2000 or pay_year < 2000 or pay_month < 1 or pay_month > 12:
-        flash("Datas inválidas.", "warning")
-        return redirect(url_for("payroll.employee_thirteenth", employee_id=e.id))
+    if ref_year >= 2000 and _valid_competence(pay_year, pay_month):
+        list_url = url_for("payroll.employee_thirteenth", employee_id=employee_id, year=pay_year, month=pay_month)
+    else:
+        list_url = url_for("payroll.employee_thirteenth", employee_id=employee_id)
 
-    if payment_type not in ("1st_installment", "2nd_installment", "full"):
-        flash("Tipo de pagamento inválido.", "warning")
-        return redirect(url_for("payroll.employee_thirteenth", employee_id=e.id, year=pay_year, month=pay_month))
+    error = _thirteenth_form_error(ref_year, pay_year, pay_month, payment_type, months_worked)
+    if error:
+        flash(error, "warning")
+        return redirect(list_url)
 
-    if months_worked < 1 or months_worked > 12:
-        flash("Meses trabalhados devem ser entre 1 e 12.", "warning")
-        return redirect(url_for("payroll.employee_thirteenth", employee_id=e.id, year=pay_year, month=pay_month))
+    e = Employee.query.get_or_404(employee_id)
 
     # Usa salário do mês de pagamento como base
     base_salary = _salary_for_employee(e, pay_year, pay_month)
     amounts = _calc_thirteenth_amount(base_salary, months_worked)
 
-    # Estimativa de descontos apenas para 2ª parcela (conforme CLT)
-    comp = _competence_start(pay_year, pay_month)
-    deps_count = EmployeeDependent.query.filter_by(employee_id=e.id).count()
-    inss_eff, inss_rows = _latest_inss_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
-
     inss_est = None
     irrf_est = None
     net_est = None
     gross = amounts["gross_amount"]
 
-    # CLT: descontos aplicam-se na 2ª parcela (ou no integral se for único pagamento)
-    apply_discounts = payment_type in ("2nd_installment", "full")
-    if apply_discounts and inss_rows:
-        inss_est = _calc_inss_progressive(gross, inss_rows)
-    if apply_discounts and irrf_rows and irrf_cfg and inss_est is not None:
-        irrf_est = _calc_irrf(gross - inss_est, irrf_cfg, irrf_rows, deps_count)
+    # CLT: descontos aplicam-se na 2ª parcela (ou no integral se for único pagamento);
+    # na 1ª parcela as tabelas nem são consultadas.
+    apply_discounts = payment_type in _THIRTEENTH_DISCOUNT_PAYMENT_TYPES
+    if apply_discounts:
+        tables = _tax_tables_for(_competence_start(pay_year, pay_month))
+        inss_rows = tables["inss_rows"]
+        irrf_cfg = tables["irrf_cfg"]
+        irrf_rows = tables["irrf_rows"]
+        if inss_rows:
+            inss_est = _calc_inss_progressive(gross, inss_rows)
+        if irrf_rows and irrf_cfg and inss_est is not None:
+            irrf_est = _calc_irrf(gross - inss_est, irrf_cfg, irrf_rows, e.dependents_count)
     if inss_est is not None and irrf_est is not None:
-        net_est = (gross - inss_est - irrf_est).quantize(Decimal("0.01"))
+        net_est = (gross - inss_est - irrf_est).quantize(_CENT)
 
     row = EmployeeThirteenth(
         employee_id=e.id,
@@ -2617,19 +3299,16 @@ def employee_thirteenth_add(employee_id: int):
     db.session.commit()
 
     flash("13º salário registrado.", "success")
-    return redirect(url_for("payroll.employee_thirteenth", employee_id=e.id, year=pay_year, month=pay_month))
+    return redirect(list_url)
 
 
 @payroll_bp.get("/thirteenth/<int:thirteenth_id>/receipt")
 @login_required
 def thirteenth_receipt(thirteenth_id: int):
     """Recibo imprimível do 13º salário."""
-    t = EmployeeThirteenth.query.get_or_404(thirteenth_id)
+    t = EmployeeThirteenth.query.options(joinedload(EmployeeThirteenth.employee)).filter_by(id=thirteenth_id).first_or_404()
 
-    comp = _competence_start(int(t.payment_year), int(t.payment_month))
-    inss_eff, inss_rows = _latest_inss_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
+    tables = _tax_tables_for(_competence_start(int(t.payment_year), int(t.payment_month)))
 
     # CLT: avisos sobre prazos
     clt_warnings = []
@@ -2644,9 +3323,9 @@ def thirteenth_receipt(thirteenth_id: int):
         "payroll/thirteenth_receipt.html",
         t=t,
         employee=t.employee,
-        inss_eff=inss_eff,
-        irrf_eff=irrf_eff,
-        has_tables=bool(inss_rows) and bool(irrf_rows) and bool(irrf_cfg),
+        inss_eff=tables["inss_eff"],
+        irrf_eff=tables["irrf_eff"],
+        has_tables=tables["has_tables"],
         clt_warnings=clt_warnings,
     )
 
@@ -2655,60 +3334,85 @@ def thirteenth_receipt(thirteenth_id: int):
 @login_required
 def employee_terminations(employee_id: int):
     e = Employee.query.get_or_404(employee_id)
-    now = datetime.now()
+    now = _request_now()
     year = int(request.args.get("year") or now.year)
     month = int(request.args.get("month") or now.month)
     rows = (
-        EmployeeTermination.query.filter_by(employee_id=e.id)
+        db.session.query(
+            EmployeeTermination.id,
+            EmployeeTermination.termination_date,
+            EmployeeTermination.termination_type,
+            EmployeeTermination.notice_type,
+            EmployeeTermination.notice_days,
+            EmployeeTermination.fgts_fine_est,
+            EmployeeTermination.gross_total,
+        )
+        .filter(EmployeeTermination.employee_id == e.id)
         .order_by(EmployeeTermination.termination_date.desc(), EmployeeTermination.id.desc())
         .all()
     )
     return render_template("payroll/employee_terminations.html", e=e, year=year, month=month, rows=rows)
 
 
+def _termination_form_error(
+    year: int,
+    month: int,
+    termination_date: date | None,
+    termination_type: str,
+    notice_type: str,
+    notice_days: int,
+) -> str | None:
+    if not _valid_competence(year, month) or not termination_date:
+        return "Dados da rescisão inválidos."
+    if termination_type not in _VALID_TERMINATION_TYPES:
+        return "Tipo de rescisão inválido."
+    if notice_type not in _VALID_NOTICE_TYPES:
+        return "Tipo de aviso prévio inválido."
+    if notice_days < 0 or notice_days > 120:
+        return "Dias de aviso prévio inválidos."
+    return None
+
+
 @payroll_bp.post("/employees/<int:employee_id>/terminations")
 @login_required
 def employee_terminations_add(employee_id: int):
-    e = Employee.query.get_or_404(employee_id)
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
+    year, month = _form_competence()
     termination_date = _parse_date(request.form.get("termination_date"))
     termination_type = (request.form.get("termination_type") or "").strip().lower()
     notice_type = (request.form.get("notice_type") or "none").strip().lower()
     notice_days = int(request.form.get("notice_days") or 0)
     reason = (request.form.get("reason") or "").strip() or None
     gross_total = _to_decimal(request.form.get("gross_total"))
-    fgts_balance_est = _to_decimal(request.form.get("fgts_balance_est"), default=Decimal("0"))
+    fgts_balance_est = _to_decimal(request.form.get("fgts_balance_est"), default=_ZERO)
     fgts_fine_rate_in = _to_decimal(request.form.get("fgts_fine_rate"), default=Decimal("-1"))
 
-    if year < 2000 or month < 1 or month > 12 or not termination_date:
-        flash("Dados da rescisão inválidos.", "warning")
-        return redirect(url_for("payroll.employee_terminations", employee_id=e.id))
+    if _valid_competence(year, month) and termination_date:
+        list_url = url_for("payroll.employee_terminations", employee_id=employee_id, year=year, month=month)
+    else:
+        list_url = url_for("payroll.employee_terminations", employee_id=employee_id)
 
-    if termination_type not in ("without_cause", "with_cause", "agreement", "resignation"):
-        flash("Tipo de rescisão inválido.", "warning")
-        return redirect(url_for("payroll.employee_terminations", employee_id=e.id, year=year, month=month))
-    if notice_type not in ("worked", "indemnified", "none"):
-        flash("Tipo de aviso prévio inválido.", "warning")
-        return redirect(url_for("payroll.employee_terminations", employee_id=e.id, year=year, month=month))
-    if notice_days < 0 or notice_days > 120:
-        flash("Dias de aviso prévio inválidos.", "warning")
-        return redirect(url_for("payroll.employee_terminations", employee_id=e.id, year=year, month=month))
+    error = _termination_form_error(year, month, termination_date, termination_type, notice_type, notice_days)
+    if error:
+        flash(error, "warning")
+        return redirect(list_url)
+
+    e = Employee.query.get_or_404(employee_id)
 
     inss_est = None
     irrf_est = None
     net_est = None
-    comp = _competence_start(year, month)
-    deps_count = EmployeeDependent.query.filter_by(employee_id=e.id).count()
-    _inss_eff, inss_rows = _latest_inss_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    _irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
-    if gross_total > 0 and inss_rows:
-        inss_est = _calc_inss_progressive(gross_total, inss_rows)
-    if gross_total > 0 and irrf_rows and irrf_cfg and inss_est is not None:
-        irrf_est = _calc_irrf(gross_total - inss_est, irrf_cfg, irrf_rows, deps_count)
+    # Tabelas só são consultadas quando há valor bruto a estimar.
+    if gross_total > 0:
+        tables = _tax_tables_for(_competence_start(year, month))
+        inss_rows = tables["inss_rows"]
+        irrf_cfg = tables["irrf_cfg"]
+        irrf_rows = tables["irrf_rows"]
+        if inss_rows:
+            inss_est = _calc_inss_progressive(gross_total, inss_rows)
+        if irrf_rows and irrf_cfg and inss_est is not None:
+            irrf_est = _calc_irrf(gross_total - inss_est, irrf_cfg, irrf_rows, e.dependents_count)
     if inss_est is not None and irrf_est is not None:
-        net_est = (gross_total - inss_est - irrf_est).quantize(Decimal("0.01"))
+        net_est = (gross_total - inss_est - irrf_est).quantize(_CENT)
 
     expected_rate = _termination_expected_fgts_rate(termination_type)
     if fgts_fine_rate_in < 0:
@@ -2717,7 +3421,7 @@ def employee_terminations_add(employee_id: int):
         fgts_fine_rate = fgts_fine_rate_in
     fgts_fine_est = None
     if fgts_balance_est > 0 and fgts_fine_rate > 0:
-        fgts_fine_est = (fgts_balance_est * fgts_fine_rate).quantize(Decimal("0.01"))
+        fgts_fine_est = (fgts_balance_est * fgts_fine_rate).quantize(_CENT)
 
     row = EmployeeTermination(
         employee_id=e.id,
@@ -2739,16 +3443,15 @@ def employee_terminations_add(employee_id: int):
     # Employee is no longer active after termination record
     e.active = False
     db.session.add(row)
-    db.session.add(e)
     db.session.commit()
     flash("Rescisão registrada e funcionário marcado como inativo.", "success")
-    return redirect(url_for("payroll.employee_terminations", employee_id=e.id, year=year, month=month))
+    return redirect(list_url)
 
 
 @payroll_bp.get("/terminations/<int:termination_id>/receipt")
 @login_required
 def termination_receipt(termination_id: int):
-    t = EmployeeTermination.query.get_or_404(termination_id)
+    t = EmployeeTermination.query.options(joinedload(EmployeeTermination.employee)).filter_by(id=termination_id).first_or_404()
     checklist = _termination_guided_checklist(t.termination_type, t.notice_type)
     return render_template("payroll/termination_receipt.html", t=t, employee=t.employee, checklist=checklist)
 
@@ -2757,44 +3460,75 @@ def termination_receipt(termination_id: int):
 @login_required
 def employee_leaves(employee_id: int):
     e = Employee.query.get_or_404(employee_id)
-    now = datetime.now()
+    now = _request_now()
     year = int(request.args.get("year") or now.year)
     month = int(request.args.get("month") or now.month)
     rows = (
-        EmployeeLeave.query.filter_by(employee_id=e.id)
+        db.session.query(
+            EmployeeLeave.id,
+            EmployeeLeave.leave_type,
+            EmployeeLeave.start_date,
+            EmployeeLeave.end_date,
+            EmployeeLeave.paid_by,
+        )
+        .filter(EmployeeLeave.employee_id == e.id)
         .order_by(EmployeeLeave.start_date.desc(), EmployeeLeave.id.desc())
         .all()
     )
     return render_template("payroll/employee_leaves.html", e=e, year=year, month=month, rows=rows)
 
 
+def _employee_id_or_404(employee_id: int) -> int:
+    # Existence check only: the add-forms below just need the id, not the whole Employee row.
+    eid = db.session.query(Employee.id).filter_by(id=employee_id).scalar()
+    if eid is None:
+        abort(404)
+    return eid
+
+
+def _leave_form_error(
+    year: int,
+    month: int,
+    start_date: date | None,
+    end_date: date | None,
+    leave_type: str,
+    paid_by: str,
+) -> str | None:
+    if not _valid_competence(year, month):
+        return "Competência inválida."
+    if not start_date or not end_date or end_date < start_date:
+        return "Período do afastamento inválido."
+    if leave_type not in _VALID_LEAVE_TYPES:
+        return "Tipo de afastamento inválido."
+    if paid_by not in _VALID_LEAVE_PAID_BY:
+        return "Origem de pagamento inválida."
+    return None
+
+
 @payroll_bp.post("/employees/<int:employee_id>/leaves")
 @login_required
 def employee_leaves_add(employee_id: int):
-    e = Employee.query.get_or_404(employee_id)
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
+    year, month = _form_competence()
     leave_type = (request.form.get("leave_type") or "").strip().lower()
     start_date = _parse_date(request.form.get("start_date"))
     end_date = _parse_date(request.form.get("end_date"))
     paid_by = (request.form.get("paid_by") or "").strip().lower()
     reason = (request.form.get("reason") or "").strip() or None
 
-    if year < 2000 or month < 1 or month > 12:
-        flash("Competência inválida.", "warning")
-        return redirect(url_for("payroll.employee_leaves", employee_id=e.id))
-    if not start_date or not end_date or end_date < start_date:
-        flash("Período do afastamento inválido.", "warning")
-        return redirect(url_for("payroll.employee_leaves", employee_id=e.id, year=year, month=month))
-    if leave_type not in ("medical", "maternity", "accident", "unpaid", "other"):
-        flash("Tipo de afastamento inválido.", "warning")
-        return redirect(url_for("payroll.employee_leaves", employee_id=e.id, year=year, month=month))
-    if paid_by not in ("company", "inss", "mixed"):
-        flash("Origem de pagamento inválida.", "warning")
-        return redirect(url_for("payroll.employee_leaves", employee_id=e.id, year=year, month=month))
+    if _valid_competence(year, month):
+        list_url = url_for("payroll.employee_leaves", employee_id=employee_id, year=year, month=month)
+    else:
+        list_url = url_for("payroll.employee_leaves", employee_id=employee_id)
+
+    error = _leave_form_error(year, month, start_date, end_date, leave_type, paid_by)
+    if error:
+        flash(error, "warning")
+        return redirect(list_url)
+
+    employee_id = _employee_id_or_404(employee_id)
 
     row = EmployeeLeave(
-        employee_id=e.id,
+        employee_id=employee_id,
         year=year,
         month=month,
         leave_type=leave_type,
@@ -2806,53 +3540,54 @@ def employee_leaves_add(employee_id: int):
     db.session.add(row)
     db.session.commit()
     flash("Afastamento registrado.", "success")
-    return redirect(url_for("payroll.employee_leaves", employee_id=e.id, year=year, month=month))
+    return redirect(list_url)
 
 
 @payroll_bp.post("/employees/<int:employee_id>/salary")
 @login_required
 def employee_add_salary(employee_id: int):
-    e = Employee.query.get_or_404(employee_id)
+    employee_id = _employee_id_or_404(employee_id)
     eff_raw = (request.form.get("effective_from") or "").strip()
     base_raw = (request.form.get("base_salary") or "").strip()
 
     eff = _parse_date(eff_raw)
     if not eff:
         flash("Data de vigência inválida.", "warning")
-        return redirect(url_for("payroll.employee_detail", employee_id=e.id))
+        return redirect(url_for("payroll.employee_detail", employee_id=employee_id))
 
     base = _to_decimal(base_raw)
     if base <= 0:
         flash("Informe um salário base válido.", "warning")
-        return redirect(url_for("payroll.employee_detail", employee_id=e.id))
+        return redirect(url_for("payroll.employee_detail", employee_id=employee_id))
 
-    s = EmployeeSalary(employee_id=e.id, effective_from=eff, base_salary=base)
+    s = EmployeeSalary(employee_id=employee_id, effective_from=eff, base_salary=base)
     db.session.add(s)
     db.session.commit()
+    g.pop("_salary_cache", None)
     flash("Salário registrado.", "success")
-    return redirect(url_for("payroll.employee_detail", employee_id=e.id))
+    return redirect(url_for("payroll.employee_detail", employee_id=employee_id))
 
 
 @payroll_bp.post("/employees/<int:employee_id>/dependent")
 @login_required
 def employee_add_dependent(employee_id: int):
-    e = Employee.query.get_or_404(employee_id)
+    employee_id = _employee_id_or_404(employee_id)
     full_name = (request.form.get("dep_full_name") or "").strip()
     cpf = (request.form.get("dep_cpf") or "").strip() or None
     if not full_name:
         flash("Informe o nome do dependente.", "warning")
-        return redirect(url_for("payroll.employee_detail", employee_id=e.id))
-    d = EmployeeDependent(employee_id=e.id, full_name=full_name, cpf=cpf)
+        return redirect(url_for("payroll.employee_detail", employee_id=employee_id))
+    d = EmployeeDependent(employee_id=employee_id, full_name=full_name, cpf=cpf)
     db.session.add(d)
     db.session.commit()
     flash("Dependente registrado.", "success")
-    return redirect(url_for("payroll.employee_detail", employee_id=e.id))
+    return redirect(url_for("payroll.employee_detail", employee_id=employee_id))
 
 
 @payroll_bp.get("/")
 @login_required
 def payroll_home():
-    now = datetime.now()
+    now = _request_now()
     year = int(request.args.get("year") or now.year)
     month = int(request.args.get("month") or now.month)
 
@@ -2863,9 +3598,8 @@ def payroll_home():
 @payroll_bp.post("/")
 @login_required
 def payroll_create_or_open():
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
-    if year < 2000 or month < 1 or month > 12:
+    year, month = _form_competence()
+    if not _valid_competence(year, month):
         flash("Competência inválida.", "warning")
         return redirect(url_for("payroll.payroll_home"))
 
@@ -2882,16 +3616,17 @@ def payroll_create_or_open():
         db.session.flush()
 
         employees = Employee.query.filter_by(active=True).order_by(Employee.full_name.asc()).all()
+        salaries = _salaries_for_employees([e.id for e in employees], year, month)
         for e in employees:
-            base = _salary_for_employee(e, year, month)
+            base = salaries.get(e.id, _ZERO)
             line_rate = _overtime_rate_from_salary(base, run.overtime_weekly_hours, run.overtime_additional_pct)
             line = PayrollLine(
                 payroll_run_id=run.id,
                 employee_id=e.id,
                 base_salary=base,
-                overtime_hours=Decimal("0"),
+                overtime_hours=_ZERO,
                 overtime_hour_rate=line_rate,
-                overtime_amount=Decimal("0"),
+                overtime_amount=_ZERO,
                 gross_total=base,
             )
             db.session.add(line)
@@ -2905,8 +3640,13 @@ def payroll_create_or_open():
 @login_required
 def payroll_edit(run_id: int):
     run = PayrollRun.query.get_or_404(run_id)
-    lines = PayrollLine.query.filter_by(payroll_run_id=run.id).order_by(PayrollLine.id.asc()).all()
-    monthly_hours = _monthly_hours_from_weekly(Decimal(str(run.overtime_weekly_hours or 44)))
+    lines = (
+        PayrollLine.query.options(joinedload(PayrollLine.employee))
+        .filter_by(payroll_run_id=run.id)
+        .order_by(PayrollLine.id.asc())
+        .all()
+    )
+    monthly_hours = _monthly_hours_from_weekly(run.overtime_weekly_hours)
     return render_template("payroll/payroll_edit.html", run=run, lines=lines, monthly_hours=monthly_hours)
 
 
@@ -2923,40 +3663,59 @@ def payroll_save(run_id: int):
 
     weekly_hours = _to_decimal(
         request.form.get("overtime_weekly_hours"),
-        default=Decimal(str(run.overtime_weekly_hours or 44)),
+        default=Decimal(run.overtime_weekly_hours or _DEFAULT_WEEKLY_HOURS),
     )
     if weekly_hours <= 0:
-        weekly_hours = Decimal("44")
+        weekly_hours = _DEFAULT_WEEKLY_HOURS
 
     additional_pct = _to_decimal(
         request.form.get("overtime_additional_pct"),
-        default=Decimal(str(run.overtime_additional_pct or 50)),
+        default=Decimal(run.overtime_additional_pct or _DEFAULT_OVERTIME_PCT),
     )
     if additional_pct < 0:
-        additional_pct = Decimal("0")
+        additional_pct = _ZERO
 
     run.overtime_weekly_hours = weekly_hours
     run.overtime_additional_pct = additional_pct
 
-    lines = PayrollLine.query.filter_by(payroll_run_id=run.id).all()
+    hours_by_employee: dict[int, str] = {}
+    for key, value in request.form.items():
+        if key.startswith("overtime_hours_"):
+            try:
+                hours_by_employee[int(key[len("overtime_hours_"):])] = value
+            except ValueError:
+                continue
+
+    lines = (
+        db.session.query(PayrollLine.id, PayrollLine.employee_id, PayrollLine.base_salary)
+        .filter(PayrollLine.payroll_run_id == run.id)
+        .order_by(PayrollLine.id.asc())
+        .all()
+    )
+    updates = []
     first_rate = None
-    for ln in lines:
-        key = f"overtime_hours_{ln.employee_id}"
-        hours = _to_decimal(request.form.get(key), default=Decimal("0"))
+    for line_id, employee_id, base_salary in lines:
+        hours = _to_decimal(hours_by_employee.get(employee_id), default=_ZERO)
         if hours < 0:
-            hours = Decimal("0")
-        rate = _overtime_rate_from_salary(ln.base_salary, run.overtime_weekly_hours, run.overtime_additional_pct)
-        ln.overtime_hours = hours
-        ln.overtime_hour_rate = rate
-        ln.overtime_amount = (hours * rate).quantize(Decimal("0.01"))
-        ln.gross_total = (Decimal(str(ln.base_salary)) + ln.overtime_amount).quantize(Decimal("0.01"))
+            hours = _ZERO
+        rate = _overtime_rate_from_salary(base_salary, weekly_hours, additional_pct)
+        overtime_amount = (hours * rate).quantize(_CENT)
+        updates.append(
+            {
+                "id": line_id,
+                "overtime_hours": hours,
+                "overtime_hour_rate": rate,
+                "overtime_amount": overtime_amount,
+                "gross_total": (Decimal(base_salary or 0) + overtime_amount).quantize(_CENT),
+            }
+        )
         if first_rate is None:
             first_rate = rate
-        db.session.add(ln)
 
-    run.overtime_hour_rate = first_rate if first_rate is not None else Decimal("0")
+    if updates:
+        db.session.bulk_update_mappings(PayrollLine, updates)
+    run.overtime_hour_rate = first_rate if first_rate is not None else _ZERO
 
-    db.session.add(run)
     db.session.commit()
     flash("Folha salva.", "success")
     return redirect(url_for("payroll.payroll_edit", run_id=run.id))
@@ -2972,8 +3731,8 @@ def payroll_holerite(run_id: int, employee_id: int):
         return redirect(url_for("payroll.payroll_edit", run_id=run.id))
 
     comp = date(int(run.year), int(run.month), 1)
-    deps_count = EmployeeDependent.query.filter_by(employee_id=employee_id).count()
-    gross = (Decimal(str(ln.gross_total or 0)) if ln.gross_total is not None else Decimal("0"))
+    deps_count = ln.employee.dependents_count
+    gross = ln.gross_total if ln.gross_total is not None else _ZERO
 
     inss_eff, inss_rows = _latest_inss_brackets(comp)
     irrf_cfg = _latest_irrf_config(comp)
@@ -3021,7 +3780,7 @@ def _tax_config_context() -> dict:
 @login_required
 def tax_sync_trigger():
     try:
-        target_year = int(request.form.get("target_year") or date.today().year)
+        target_year = int(request.form.get("target_year") or _request_today().year)
     except (TypeError, ValueError):
         target_year = 0
     mode = (request.form.get("mode") or "dry_run").strip().lower()
@@ -3035,6 +3794,7 @@ def tax_sync_trigger():
     sync_result = None
     try:
         sync_result = run_tax_sync(target_year=target_year, apply_changes=apply_changes)
+        _clear_tax_tables_cache()
         if sync_result.get("applied"):
             flash("Sincronização concluída e tabelas fiscais gravadas no banco.", "success")
         else:
@@ -3071,6 +3831,7 @@ def tax_inss_add():
     row = TaxInssBracket(effective_from=eff, up_to=up_to, rate=rate)
     db.session.add(row)
     db.session.commit()
+    _clear_tax_tables_cache()
     flash("Faixa INSS adicionada.", "success")
     return redirect(url_for("payroll.tax_config"))
 
@@ -3087,7 +3848,7 @@ def tax_irrf_config_set():
 
     dep = _to_decimal(dep_raw)
     if dep < 0:
-        dep = Decimal("0")
+        dep = _ZERO
 
     cfg = TaxIrrfConfig.query.filter_by(effective_from=eff).first()
     if not cfg:
@@ -3096,6 +3857,7 @@ def tax_irrf_config_set():
     else:
         cfg.dependent_deduction = dep
     db.session.commit()
+    _clear_tax_tables_cache()
     flash("Config IRRF salva.", "success")
     return redirect(url_for("payroll.tax_config"))
 
@@ -3122,6 +3884,7 @@ def tax_irrf_add():
     row = TaxIrrfBracket(effective_from=eff, up_to=up_to, rate=rate, deduction=ded)
     db.session.add(row)
     db.session.commit()
+    _clear_tax_tables_cache()
     flash("Faixa IRRF adicionada.", "success")
     return redirect(url_for("payroll.tax_config"))
 
@@ -3153,6 +3916,12 @@ def _coerce_to_date(value: object) -> date | None:
     return None
 
 
+# Faixas de dias até o vencimento: < 0 atrasado, 0..3 vence em breve, >= 4 no prazo.
+_DEADLINE_DAY_LIMITS = (0, 4)
+_DEADLINE_DAY_STATUSES = ("danger", "warning", "ok")
+_DEADLINE_NOTES = {"paid": "Pago", "danger": "Atrasado", "warning": "Vence em breve"}
+
+
 def _deadline_status(today: date, due_date: date | None, paid_at: date | None) -> str:
     due = _coerce_to_date(due_date)
     paid = _coerce_to_date(paid_at)
@@ -3160,16 +3929,11 @@ def _deadline_status(today: date, due_date: date | None, paid_at: date | None) -
         return "paid"
     if due is None:
         return "pending"
-    days_left = (due - today).days
-    if days_left < 0:
-        return "danger"
-    if days_left <= 3:
-        return "warning"
-    return "ok"
+    return _DEADLINE_DAY_STATUSES[bisect_right(_DEADLINE_DAY_LIMITS, (due - today).days)]
 
 
 def _build_legal_deadlines(year: int, month: int, docs: dict[str, GuideDocument | None]) -> list[dict]:
-    today = date.today()
+    today = _request_today()
     ny, nm = _next_month(year, month)
     default_due = date(int(ny), int(nm), 20)
 
@@ -3191,21 +3955,21 @@ def _build_legal_deadlines(year: int, month: int, docs: dict[str, GuideDocument
         },
     ]
 
+    # As guias sem vencimento informado compartilham o prazo padrão: o status é calculado uma vez.
+    default_status = _deadline_status(today=today, due_date=default_due, paid_at=None)
+
     out: list[dict] = []
     for item in items:
         doc = docs.get(item["key"])
         due_date = _coerce_to_date((getattr(doc, "due_date", None) if doc else None)) or default_due
         paid_at = _coerce_to_date(getattr(doc, "paid_at", None) if doc else None)
-        status = _deadline_status(today=today, due_date=due_date, paid_at=paid_at)
-
         if paid_at:
-            note = "Pago"
-        elif status == "danger":
-            note = "Atrasado"
-        elif status == "warning":
-            note = "Vence em breve"
+            status = "paid"
+        elif due_date == default_due:
+            status = default_status
         else:
-            note = "No prazo"
+            status = _deadline_status(today=today, due_date=due_date, paid_at=None)
+        note = _DEADLINE_NOTES.get(status, "No prazo")
 
         out.append(
             {
@@ -3308,9 +4072,10 @@ def _build_pending_center(checklist: dict[str, dict], obligations_agenda: list[d
 
 def _compute_competence_risk(checklist: dict[str, dict], pending_center: list[dict]) -> dict:
     checklist_blocked = sum(1 for item in checklist.values() if not bool(item.get("ok")))
-    overdue_count = sum(1 for item in pending_center if item.get("bucket") == "overdue")
-    today_count = sum(1 for item in pending_center if item.get("bucket") == "today")
-    next_7_count = sum(1 for item in pending_center if item.get("bucket") == "next_7_days")
+    bucket_counts = Counter(item.get("bucket") for item in pending_center)
+    overdue_count = bucket_counts["overdue"]
+    today_count = bucket_counts["today"]
+    next_7_count = bucket_counts["next_7_days"]
 
     score = min(100, (checklist_blocked * 20) + (overdue_count * 25) + (today_count * 15) + (next_7_count * 7))
     if score >= 70:
@@ -3386,22 +4151,30 @@ def _official_guides_catalog(year: int, month: int) -> list[dict]:
     ]
 
 
+# Lembretes por faixa de dias: < 0, 0, 1, 2..3, 4..7, >= 8 (`{d}` = dias restantes, `{late}` = dias de atraso).
+_REMINDER_DAY_LIMITS = (0, 1, 2, 4, 8)
+_REMINDER_DAY_LABELS = (
+    "Atrasado ha {late} dia(s)",
+    "Vence hoje (D-0)",
+    "Vence amanha (D-1)",
+    "Prazo critico (D-{d})",
+    "Planejar esta semana (D-{d})",
+    "No radar (D-{d})",
+)
+
+
 def _reminder_label(days_left: int | None, paid_at: date | None) -> str:
     if paid_at:
         return "Concluido"
     if days_left is None:
         return "Sem vencimento definido"
-    if days_left < 0:
-        return f"Atrasado ha {abs(days_left)} dia(s)"
-    if days_left == 0:
-        return "Vence hoje (D-0)"
-    if days_left == 1:
-        return "Vence amanha (D-1)"
-    if days_left <= 3:
-        return f"Prazo critico (D-{days_left})"
-    if days_left <= 7:
-        return f"Planejar esta semana (D-{days_left})"
-    return f"No radar (D-{days_left})"
+    label = _REMINDER_DAY_LABELS[bisect_right(_REMINDER_DAY_LIMITS, days_left)]
+    return label.format(d=days_left, late=abs(days_left))
+
+
+# Faixas de dias até o vencimento na agenda: < 0 atrasado, 0 hoje, 1..7 próximos 7 dias, >= 8 depois.
+_AGENDA_DAY_LIMITS = (0, 1, 8)
+_AGENDA_DAY_BUCKETS = ("overdue", "today", "next_7_days", "later")
 
 
 def _agenda_bucket(days_left: int | None, paid_at: date | None) -> str:
@@ -3409,13 +4182,7 @@ def _agenda_bucket(days_left: int | None, paid_at: date | None) -> str:
         return "done"
     if days_left is None:
         return "next_7_days"
-    if days_left < 0:
-        return "overdue"
-    if days_left == 0:
-        return "today"
-    if days_left <= 7:
-        return "next_7_days"
-    return "later"
+    return _AGENDA_DAY_BUCKETS[bisect_right(_AGENDA_DAY_LIMITS, days_left)]
 
 
 def _agenda_resolution_steps(bucket: str, action_label: str, title: str) -> list[str]:
@@ -3428,10 +4195,38 @@ def _agenda_resolution_steps(bucket: str, action_label: str, title: str) -> list
     ]
 
 
+def _agenda_item(
+    *,
+    title: str,
+    due_date: date | None,
+    paid_at: date | None,
+    today: date,
+    action_url: str,
+    action_label: str,
+    why: str,
+) -> dict:
+    days_left = (due_date - today).days if due_date else None
+    bucket = _agenda_bucket(days_left=days_left, paid_at=paid_at)
+    return {
+        "title": title,
+        "due_date": due_date,
+        "paid_at": paid_at,
+        "days_left": days_left,
+        "reminder": _reminder_label(days_left=days_left, paid_at=paid_at),
+        "bucket": bucket,
+        "action_url": action_url,
+        "action_label": action_label,
+        "why": why,
+        "resolution_steps": _agenda_resolution_steps(bucket=bucket, action_label=action_label, title=title),
+    }
+
+
 def _build_obligations_agenda(year: int, month: int, docs: dict[str, GuideDocument | None]) -> list[dict]:
-    today = date.today()
+    today = _request_today()
     ny, nm = _next_month(year, month)
     default_due = date(int(ny), int(nm), 20)
+    close_url = url_for("payroll.close_home", year=year, month=month)
+    employees_url = url_for("payroll.employees")
 
     agenda_items: list[dict] = []
     for key, title in (
@@ -3440,172 +4235,91 @@ def _build_obligations_agenda(year: int, month: int, docs: dict[str, GuideDocume
         ("darf", "Emitir e conferir DARF da folha"),
     ):
         doc = docs.get(key)
-        due_date = _coerce_to_date((getattr(doc, "due_date", None) if doc else None)) or default_due
-        paid_at = _coerce_to_date(getattr(doc, "paid_at", None) if doc else None)
-        days_left = (due_date - today).days if due_date else None
-        bucket = _agenda_bucket(days_left=days_left, paid_at=paid_at)
-        action_label = "Abrir guias"
-        title_full = title
         agenda_items.append(
-            {
-                "title": title_full,
-                "due_date": due_date,
-                "paid_at": paid_at,
-                "days_left": days_left,
-                "reminder": _reminder_label(days_left=days_left, paid_at=paid_at),
-                "bucket": bucket,
-                "action_url": url_for("payroll.close_home", year=year, month=month),
-                "action_label": action_label,
-                "why": "Evita atraso de encargos e reduz risco de multa/juros.",
-                "resolution_steps": _agenda_resolution_steps(bucket=bucket, action_label=action_label, title=title_full),
-            }
+            _agenda_item(
+                title=title,
+                due_date=_coerce_to_date((getattr(doc, "due_date", None) if doc else None)) or default_due,
+                paid_at=_coerce_to_date(getattr(doc, "paid_at", None) if doc else None),
+                today=today,
+                action_url=close_url,
+                action_label="Abrir guias",
+                why="Evita atraso de encargos e reduz risco de multa/juros.",
+            )
         )
 
-    if int(month) == 11:
-        due_13_first = date(int(year), 11, 30)
-        days_left = (due_13_first - today).days
-        bucket = _agenda_bucket(days_left=days_left, paid_at=None)
-        action_label = "Ver funcionarios"
-        title_full = "Conferir pagamento da 1a parcela do 13o"
+    thirteenth_due = {
+        11: (date(int(year), 11, 30), "Conferir pagamento da 1a parcela do 13o"),
+        12: (date(int(year), 12, 20), "Conferir pagamento da 2a parcela do 13o"),
+    }.get(int(month))
+    if thirteenth_due:
+        due_13, title_13 = thirteenth_due
         agenda_items.append(
-            {
-                "title": title_full,
-                "due_date": due_13_first,
-                "paid_at": None,
-                "days_left": days_left,
-                "reminder": _reminder_label(days_left=days_left, paid_at=None),
-                "bucket": bucket,
-                "action_url": url_for("payroll.employees"),
-                "action_label": action_label,
-                "why": "Ajuda a cumprir o prazo legal do 13o e evitar passivo trabalhista.",
-                "resolution_steps": _agenda_resolution_steps(bucket=bucket, action_label=action_label, title=title_full),
-            }
-        )
-    if int(month) == 12:
-        due_13_second = date(int(year), 12, 20)
-        days_left = (due_13_second - today).days
-        bucket = _agenda_bucket(days_left=days_left, paid_at=None)
-        action_label = "Ver funcionarios"
-        title_full = "Conferir pagamento da 2a parcela do 13o"
-        agenda_items.append(
-            {
-                "title": title_full,
-                "due_date": due_13_second,
-                "paid_at": None,
-                "days_left": days_left,
-                "reminder": _reminder_label(days_left=days_left, paid_at=None),
-                "bucket": bucket,
-                "action_url": url_for("payroll.employees"),
-                "action_label": action_label,
-                "why": "Ajuda a cumprir o prazo legal do 13o e evitar passivo trabalhista.",
-                "resolution_steps": _agenda_resolution_steps(bucket=bucket, action_label=action_label, title=title_full),
-            }
+            _agenda_item(
+                title=title_13,
+                due_date=due_13,
+                paid_at=None,
+                today=today,
+                action_url=employees_url,
+                action_label="Ver funcionarios",
+                why="Ajuda a cumprir o prazo legal do 13o e evitar passivo trabalhista.",
+            )
         )
 
-    compliance_due = default_due - timedelta(days=2)
-    compliance_days_left = (compliance_due - today).days
-    compliance_bucket = _agenda_bucket(days_left=compliance_days_left, paid_at=None)
-    compliance_action = "Abrir fechamento"
-    compliance_title = "Rodar compliance-check final da competencia"
     agenda_items.append(
-        {
-            "title": compliance_title,
-            "due_date": compliance_due,
-            "paid_at": None,
-            "days_left": compliance_days_left,
-            "reminder": _reminder_label(days_left=compliance_days_left, paid_at=None),
-            "bucket": compliance_bucket,
-            "action_url": url_for("payroll.close_home", year=year, month=month),
-            "action_label": compliance_action,
-            "why": "Detecta pendencias antes do vencimento das guias e evita retrabalho.",
-            "resolution_steps": _agenda_resolution_steps(bucket=compliance_bucket, action_label=compliance_action, title=compliance_title),
-        }
+        _agenda_item(
+            title="Rodar compliance-check final da competencia",
+            due_date=default_due - timedelta(days=2),
+            paid_at=None,
+            today=today,
+            action_url=close_url,
+            action_label="Abrir fechamento",
+            why="Detecta pendencias antes do vencimento das guias e evita retrabalho.",
+        )
     )
 
     agenda_items.sort(key=lambda x: (x.get("due_date") is None, x.get("due_date") or date.max))
     return agenda_items
 
 
-def _recommended_close_action(checklist: dict[str, dict]) -> dict | None:
-    priority = ["revenue", "payroll", "taxes", "guides", "vacations", "thirteenth", "terminations", "leaves"]
-    for key in priority:
-        item = checklist.get(key)
-        if item and not bool(item.get("ok")):
-            return {
-                "key": key,
-                "title": item.get("title"),
-                "help": item.get("help"),
-                "action_url": item.get("action_url"),
-                "action_label": item.get("action_label"),
-            }
-    return None
+def _agenda_by_bucket(agenda_items: list[dict]) -> dict[str, list[dict]]:
+    # Uma única passada; a agenda já vem ordenada por vencimento, então cada balde mantém essa ordem.
+    by_bucket: dict[str, list[dict]] = {"overdue": [], "today": [], "next_7_days": [], "later": [], "done": []}
+    for item in agenda_items:
+        by_bucket.setdefault(item.get("bucket"), []).append(item)
+    return by_bucket
 
 
-def _critical_close_pending_items(checklist: dict[str, dict]) -> list[dict]:
-    critical_keys = ["revenue", "payroll", "taxes", "guides"]
-    out: list[dict] = []
-    for key in critical_keys:
-        item = checklist.get(key)
-        if item and not bool(item.get("ok")):
-            out.append(
-                {
-                    "key": key,
-                    "title": item.get("title"),
-                    "help": item.get("help"),
-                    "action_url": item.get("action_url"),
-                    "action_label": item.get("action_label"),
-                }
-            )
-    return out
+# Ordem em que as pendências do fechamento são sugeridas; as 4 primeiras bloqueiam o fechamento.
+_CLOSE_PRIORITY = ("revenue", "payroll", "taxes", "guides", "vacations", "thirteenth", "terminations", "leaves")
+_CLOSE_CRITICAL = _CLOSE_PRIORITY[:4]
 
 
-@payroll_bp.get("/close")
-@login_required
-def close_home():
-    now = datetime.now()
-    try:
-        year = int(request.args.get("year") or now.year)
-    except (TypeError, ValueError):
-        year = now.year
-    try:
-        month = int(request.args.get("month") or now.month)
-    except (TypeError, ValueError):
-        month = now.month
+def _pending_close_item(key: str, item: dict) -> dict:
+    return {
+        "key": key,
+        "title": item.get("title"),
+        "help": item.get("help"),
+        "action_url": item.get("action_url"),
+        "action_label": item.get("action_label"),
+    }
 
-    if year < 2000 or month < 1 or month > 12:
-        flash("Competência inválida. Abrimos a competência atual automaticamente.", "warning")
-        year = now.year
-        month = now.month
 
-    run = PayrollRun.query.filter_by(year=year, month=month).first()
-    comp = date(int(year), int(month), 1)
-    inss_eff, inss_rows = _latest_inss_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
-    closed = CompetenceClose.query.filter_by(year=year, month=month).first()
+def _recommended_close_action(checklist: dict[str, dict]) -> dict | None:
+    for key in _CLOSE_PRIORITY:
+        item = checklist.get(key)
+        if item and not item.get("ok"):
+            return _pending_close_item(key, item)
+    return None
 
-    docs = {
-        "darf": GuideDocument.query.filter_by(year=year, month=month, doc_type="darf").first(),
-        "das": GuideDocument.query.filter_by(year=year, month=month, doc_type="das").first(),
-        "fgts": GuideDocument.query.filter_by(year=year, month=month, doc_type="fgts").first(),
-    }
-    guides_catalog = _official_guides_catalog(year=year, month=month)
-    guides_catalog_map = {row["dtype"]: row for row in guides_catalog}
-    legal_deadlines = _build_legal_deadlines(year=year, month=month, docs=docs)
-    obligations_agenda = _build_obligations_agenda(year=year, month=month, docs=docs)
-    agenda_overdue = [item for item in obligations_agenda if item.get("bucket") == "overdue"]
-    agenda_today = [item for item in obligations_agenda if item.get("bucket") == "today"]
-    agenda_next_7_days = [item for item in obligations_agenda if item.get("bucket") == "next_7_days"]
-    compliance_session_key = f"payroll_close_compliance:{year}-{month}"
-    compliance_result = session.pop(compliance_session_key, None)
 
-    summary = _calc_month_summary(run)
-    revenue_summary = _calc_revenue_month_summary(year, month)
-    vacations_summary = _calc_vacations_month_summary(year, month)
-    thirteenth_summary = _calc_thirteenth_month_summary(year, month)
-    terminations_summary = _calc_terminations_month_summary(year, month)
-    leaves_summary = _calc_leaves_month_summary(year, month)
+def _build_close_checklist(year: int, month: int, ctx: dict, *, full: bool = True) -> dict[str, dict]:
+    """Checklist de fechamento a partir de `_load_close_context`.
 
+    `full=False` monta só os itens críticos (usados para bloquear o fechamento em `close_mark`).
+    """
+    run = ctx["run"]
+    docs = ctx["docs"]
+    revenue_summary = ctx["revenue_summary"]
     checklist = {
         "revenue": {
             "ok": bool(revenue_summary.get("count")),
@@ -3622,14 +4336,14 @@ def close_home():
             "action_label": "Abrir folha",
         },
         "taxes": {
-            "ok": bool(inss_rows) and bool(irrf_rows) and bool(irrf_cfg),
+            "ok": bool(ctx["inss_rows"]) and bool(ctx["irrf_rows"]) and bool(ctx["irrf_cfg"]),
             "title": "Tabelas de INSS/IRRF",
             "help": "Essas tabelas são usadas para estimar descontos no holerite. Se estiver vazio, rode o sync ou configure manualmente.",
             "action_url": url_for("payroll.tax_config"),
             "action_label": "Ver configurações",
             "meta": {
-                "inss_eff": inss_eff,
-                "irrf_eff": irrf_eff,
+                "inss_eff": ctx["inss_eff"],
+                "irrf_eff": ctx["irrf_eff"],
             },
         },
         "guides": {
@@ -3639,50 +4353,109 @@ def close_home():
             "action_url": url_for("payroll.close_home", year=year, month=month),
             "action_label": "Anexar guias",
         },
-        "vacations": {
-            "ok": True,
-            "title": "Férias no mês",
-            "help": "Se algum funcionário recebeu férias nesta competência, registre aqui para manter o histórico e conferir valores.",
-            "action_url": url_for("payroll.employees"),
-            "action_label": "Ver funcionários",
-            "meta": {
-                "count": int(vacations_summary.get("count") or 0),
-                "total_gross": vacations_summary.get("total_gross"),
+    }
+    if not full:
+        return checklist
+
+    vacations_summary = ctx["vacations_summary"]
+    thirteenth_summary = ctx["thirteenth_summary"]
+    terminations_summary = ctx["terminations_summary"]
+    leaves_summary = ctx["leaves_summary"]
+    checklist.update(
+        {
+            "vacations": {
+                "ok": True,
+                "title": "Férias no mês",
+                "help": "Se algum funcionário recebeu férias nesta competência, registre aqui para manter o histórico e conferir valores.",
+                "action_url": url_for("payroll.employees"),
+                "action_label": "Ver funcionários",
+                "meta": {
+                    "count": int(vacations_summary.get("count") or 0),
+                    "total_gross": vacations_summary.get("total_gross"),
+                },
             },
-        },
-        "thirteenth": {
-            "ok": True,
-            "title": "13º no mês",
-            "help": "Registre parcelas do 13º (1ª até 30/nov, 2ª até 20/dez) para controle.",
-            "action_url": url_for("payroll.employees"),
-            "action_label": "Ver funcionários",
-            "meta": {
-                "count": int(thirteenth_summary.get("count") or 0),
-                "total_gross": thirteenth_summary.get("total_gross"),
+            "thirteenth": {
+                "ok": True,
+                "title": "13º no mês",
+                "help": "Registre parcelas do 13º (1ª até 30/nov, 2ª até 20/dez) para controle.",
+                "action_url": url_for("payroll.employees"),
+                "action_label": "Ver funcionários",
+                "meta": {
+                    "count": int(thirteenth_summary.get("count") or 0),
+                    "total_gross": thirteenth_summary.get("total_gross"),
+                },
             },
-        },
-        "terminations": {
-            "ok": True,
-            "title": "Rescisões no mês",
-            "help": "Registre desligamentos para manter histórico trabalhista e controle de custos.",
-            "action_url": url_for("payroll.employees"),
-            "action_label": "Ver funcionários",
-            "meta": {
-                "count": int(terminations_summary.get("count") or 0),
-                "total_gross": terminations_summary.get("total_gross"),
+            "terminations": {
+                "ok": True,
+                "title": "Rescisões no mês",
+                "help": "Registre desligamentos para manter histórico trabalhista e controle de custos.",
+                "action_url": url_for("payroll.employees"),
+                "action_label": "Ver funcionários",
+                "meta": {
+                    "count": int(terminations_summary.get("count") or 0),
+                    "total_gross": terminations_summary.get("total_gross"),
+                },
             },
-        },
-        "leaves": {
-            "ok": True,
-            "title": "Afastamentos no mês",
-            "help": "Registre atestados/licenças para checagem de regras e histórico por funcionário.",
-            "action_url": url_for("payroll.employees"),
-            "action_label": "Ver funcionários",
-            "meta": {
-                "count": int(leaves_summary.get("count") or 0),
+            "leaves": {
+                "ok": True,
+                "title": "Afastamentos no mês",
+                "help": "Registre atestados/licenças para checagem de regras e histórico por funcionário.",
+                "action_url": url_for("payroll.employees"),
+                "action_label": "Ver funcionários",
+                "meta": {
+                    "count": int(leaves_summary.get("count") or 0),
+                },
             },
-        },
-    }
+        }
+    )
+    return checklist
+
+
+def _critical_close_pending_items(checklist: dict[str, dict]) -> list[dict]:
+    return [
+        _pending_close_item(key, item)
+        for key in _CLOSE_CRITICAL
+        if (item := checklist.get(key)) and not item.get("ok")
+    ]
+
+
+@payroll_bp.get("/close")
+@login_required
+def close_home():
+    now = _request_now()
+    try:
+        year = int(request.args.get("year") or now.year)
+    except (TypeError, ValueError):
+        year = now.year
+    try:
+        month = int(request.args.get("month") or now.month)
+    except (TypeError, ValueError):
+        month = now.month
+
+    if not _valid_competence(year, month):
+        flash("Competência inválida. Abrimos a competência atual automaticamente.", "warning")
+        year = now.year
+        month = now.month
+
+    ctx = _load_close_context(year, month, with_summaries=True)
+    run = ctx["run"]
+    closed = ctx["closed"]
+    docs = ctx["docs"]
+    guides_catalog = _official_guides_catalog(year=year, month=month)
+    guides_catalog_map = {row["dtype"]: row for row in guides_catalog}
+    legal_deadlines = _build_legal_deadlines(year=year, month=month, docs=docs)
+    obligations_agenda = _build_obligations_agenda(year=year, month=month, docs=docs)
+    agenda_by_bucket = _agenda_by_bucket(obligations_agenda)
+    compliance_result = _pop_compliance_result(year, month)
+
+    summary = _calc_month_summary(run)
+    revenue_summary = ctx["revenue_summary"]
+    vacations_summary = ctx["vacations_summary"]
+    thirteenth_summary = ctx["thirteenth_summary"]
+    terminations_summary = ctx["terminations_summary"]
+    leaves_summary = ctx["leaves_summary"]
+
+    checklist = _build_close_checklist(year, month, ctx)
 
     recommended_action = _recommended_close_action(checklist)
     critical_pending_items = _critical_close_pending_items(checklist)
@@ -3712,9 +4485,7 @@ def close_home():
         summary=summary,
         legal_deadlines=legal_deadlines,
         obligations_agenda=obligations_agenda,
-        agenda_overdue=agenda_overdue,
-        agenda_today=agenda_today,
-        agenda_next_7_days=agenda_next_7_days,
+        agenda_by_bucket=agenda_by_bucket,
         compliance_result=compliance_result,
         revenue_summary=revenue_summary,
         vacations_summary=vacations_summary,
@@ -3724,19 +4495,90 @@ def close_home():
     )
 
 
+# O relatório só serve para o próximo carregamento da tela de fechamento: arquivos mais antigos que o TTL
+# (COMPLIANCE_RESULT_TTL_SECONDS) são descartados na leitura e removidos a cada nova gravação.
+_COMPLIANCE_RESULT_TTL_SECONDS = _env_seconds("COMPLIANCE_RESULT_TTL_SECONDS", 60)
+
+
+def _compliance_result_expired(path: str, now: float) -> bool:
+    return now - os.path.getmtime(path) > _COMPLIANCE_RESULT_TTL_SECONDS
+
+
+def _prune_compliance_results(folder: str) -> None:
+    now = time.time()
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(folder, name)
+        try:
+            if _compliance_result_expired(path, now):
+                os.remove(path)
+        except OSError:
+            # Outro processo já leu/removeu o arquivo: nada a fazer.
+            continue
+
+
+def _compliance_result_path(year: int, month: int) -> str:
+    folder = _ensure_dir(os.path.join(current_app.instance_path, "compliance_results"))
+    user_key = secure_filename(str(current_user.get_id() or "anon")) or "anon"
+    return os.path.join(folder, f"{user_key}_{int(year)}-{int(month):02d}.json")
+
+
+def _store_compliance_result(year: int, month: int, payload: dict) -> None:
+    # O relatório completo vai para um arquivo na instância (lido uma única vez pelo close_home);
+    # o cookie de sessão guarda só o resumo, sem crescer com as linhas do relatório.
+    path = _compliance_result_path(year, month)
+    _prune_compliance_results(os.path.dirname(path))
+    fd, tmp_path = _mkstemp_in(os.path.dirname(path), ".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(payload, fh, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    session["payroll_last_compliance_check"] = {
+        "target_year": payload["target_year"],
+        "target_month": payload["target_month"],
+        "ok": payload["ok"],
+        "issues_count": payload["issues_count"],
+        "ran_at": payload["ran_at"],
+    }
+
+
+def _pop_compliance_result(year: int, month: int) -> dict | None:
+    path = _compliance_result_path(year, month)
+    try:
+        if _compliance_result_expired(path, time.time()):
+            os.remove(path)
+            return None
+        with open(path, "r", encoding="utf-8") as fh:
+            payload = json.load(fh)
+        os.remove(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        current_app.logger.warning("Falha ao ler resultado do compliance-check: %s", exc)
+        return None
+    return payload
+
+
 @payroll_bp.post("/close/compliance")
 @login_required
 def close_run_compliance():
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
+    year, month = _form_competence()
     apply_sync = (request.form.get("apply_sync") or "0") == "1"
 
-    if year < 2000 or month < 1 or month > 12:
+    if not _valid_competence(year, month):
         flash("Competência inválida para compliance-check.", "warning")
         return redirect(url_for("payroll.close_home"))
 
     try:
         result = run_compliance_check(target_year=year, apply_tax_sync=apply_sync)
+        if apply_sync:
+            _clear_tax_tables_cache()
         if result.get("ok"):
             flash("Compliance-check concluído sem alertas.", "success")
         else:
@@ -3751,14 +4593,7 @@ def close_run_compliance():
             "sync_report_lines": list(result.get("sync_report_lines") or []),
             "ran_at": datetime.now().isoformat(timespec="seconds"),
         }
-        session[f"payroll_close_compliance:{year}-{month}"] = payload
-        session["payroll_last_compliance_check"] = {
-            "target_year": payload["target_year"],
-            "target_month": payload["target_month"],
-            "ok": payload["ok"],
-            "issues_count": payload["issues_count"],
-            "ran_at": payload["ran_at"],
-        }
+        _store_compliance_result(year, month, payload)
         _add_evidence_event(
             year=year,
             month=month,
@@ -3767,6 +4602,9 @@ def close_run_compliance():
         )
         db.session.commit()
     except Exception as e:
+        # A falha pode ter vindo do banco (sync aplicando tabelas): descarta a transação
+        # interrompida para que o evento de erro abaixo consiga ser gravado.
+        db.session.rollback()
         flash(f"Falha ao executar compliance-check: {e}", "warning")
         payload = {
             "target_year": year,
@@ -3777,14 +4615,7 @@ def close_run_compliance():
             "sync_report_lines": [],
             "ran_at": datetime.now().isoformat(timespec="seconds"),
         }
-        session[f"payroll_close_compliance:{year}-{month}"] = payload
-        session["payroll_last_compliance_check"] = {
-            "target_year": payload["target_year"],
-            "target_month": payload["target_month"],
-            "ok": payload["ok"],
-            "issues_count": payload["issues_count"],
-            "ran_at": payload["ran_at"],
-        }
+        _store_compliance_result(year, month, payload)
         _add_evidence_event(
             year=year,
             month=month,
@@ -3799,18 +4630,25 @@ def close_run_compliance():
 @payroll_bp.get("/revenue")
 @login_required
 def revenue_home():
-    now = datetime.now()
+    now = _request_now()
     year = int(request.args.get("year") or now.year)
     month = int(request.args.get("month") or now.month)
 
-    notes = RevenueNote.query.filter_by(year=year, month=month).order_by(RevenueNote.issued_at.asc().nullslast()).all()
-    total = Decimal("0")
-    for n in notes:
-        try:
-            total += Decimal(str(n.amount or 0))
-        except Exception:
-            total += Decimal("0")
-    total = total.quantize(Decimal("0.01"))
+    notes = (
+        RevenueNote.query.options(
+            load_only(
+                RevenueNote.id,
+                RevenueNote.issued_at,
+                RevenueNote.customer_name,
+                RevenueNote.description,
+                RevenueNote.amount,
+            )
+        )
+        .filter_by(year=year, month=month)
+        .order_by(RevenueNote.issued_at.asc().nullslast())
+        .all()
+    )
+    total = _calc_revenue_month_summary(year, month)["total"]
 
     return render_template(
         "payroll/revenue_home.html",
@@ -3824,9 +4662,8 @@ def revenue_home():
 @payroll_bp.post("/revenue")
 @login_required
 def revenue_add():
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
-    if year < 2000 or month < 1 or month > 12:
+    year, month = _form_competence()
+    if not _valid_competence(year, month):
         flash("Competência inválida.", "warning")
         return redirect(url_for("payroll.revenue_home"))
 
@@ -3867,58 +4704,35 @@ def revenue_delete(note_id: int):
     return redirect(url_for("payroll.revenue_home", year=year, month=month))
 
 
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _mark_competence_closed(year: int, month: int) -> None:
+    # INSERT ... ON CONFLICT (year, month) DO NOTHING: um único comando e sem corrida entre dois
+    # cliques simultâneos em "Fechar" (a unicidade já é garantida por uq_competence_close_year_month).
+    dialect_insert = _UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+    if dialect_insert is None:
+        if not CompetenceClose.query.filter_by(year=year, month=month).first():
+            db.session.add(CompetenceClose(year=year, month=month))
+        return
+    stmt = (
+        dialect_insert(CompetenceClose)
+        .values(year=year, month=month, closed_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["year", "month"])
+    )
+    db.session.execute(stmt)
+
+
 @payroll_bp.post("/close/mark")
 @login_required
 def close_mark():
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
-    if year < 2000 or month < 1 or month > 12:
+    year, month = _form_competence()
+    if not _valid_competence(year, month):
         flash("Competência inválida.", "warning")
         return redirect(url_for("payroll.close_home"))
 
-    run = PayrollRun.query.filter_by(year=year, month=month).first()
-    comp = date(int(year), int(month), 1)
-    inss_eff, inss_rows = _latest_inss_brackets(comp)
-    irrf_cfg = _latest_irrf_config(comp)
-    irrf_eff, irrf_rows = _latest_irrf_brackets(comp)
-    docs = {
-        "darf": GuideDocument.query.filter_by(year=year, month=month, doc_type="darf").first(),
-        "das": GuideDocument.query.filter_by(year=year, month=month, doc_type="das").first(),
-        "fgts": GuideDocument.query.filter_by(year=year, month=month, doc_type="fgts").first(),
-    }
-    revenue_summary = _calc_revenue_month_summary(year, month)
-
-    close_checklist = {
-        "revenue": {
-            "ok": bool(revenue_summary.get("count")),
-            "title": "Receitas / notas do mês",
-            "help": "Registre as notas (receitas) da competência.",
-            "action_url": url_for("payroll.revenue_home", year=year, month=month),
-            "action_label": "Registrar receitas",
-        },
-        "payroll": {
-            "ok": bool(run),
-            "title": "Folha do mês",
-            "help": "Crie/abra a folha da competência para gerar holerites.",
-            "action_url": url_for("payroll.payroll_home", year=year, month=month),
-            "action_label": "Abrir folha",
-        },
-        "taxes": {
-            "ok": bool(inss_rows) and bool(irrf_rows) and bool(irrf_cfg),
-            "title": "Tabelas de INSS/IRRF",
-            "help": "Sincronize ou configure as tabelas fiscais vigentes.",
-            "action_url": url_for("payroll.tax_config"),
-            "action_label": "Ver configurações",
-            "meta": {"inss_eff": inss_eff, "irrf_eff": irrf_eff},
-        },
-        "guides": {
-            "ok": all(bool(docs.get(k)) and bool(getattr(docs.get(k), "filename", None)) for k in ("darf", "das", "fgts")),
-            "title": "Guias anexadas (DARF/DAS/FGTS)",
-            "help": "Anexe os PDFs das guias da competência.",
-            "action_url": url_for("payroll.close_home", year=year, month=month),
-            "action_label": "Anexar guias",
-        },
-    }
+    ctx = _load_close_context(year, month)
+    close_checklist = _build_close_checklist(year, month, ctx, full=False)
 
     critical_pending = _critical_close_pending_items(close_checklist)
     if critical_pending:
@@ -3927,10 +4741,7 @@ def close_mark():
             flash(f"Pendente: {item['title']} — {item['help']}", "warning")
         return redirect(url_for("payroll.close_home", year=year, month=month))
 
-    row = CompetenceClose.query.filter_by(year=year, month=month).first()
-    if not row:
-        row = CompetenceClose(year=year, month=month)
-        db.session.add(row)
+    _mark_competence_closed(year, month)
     _add_evidence_event(
         year=year,
         month=month,
@@ -3945,9 +4756,8 @@ def close_mark():
 @payroll_bp.post("/close/reopen")
 @login_required
 def close_reopen():
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
-    if year < 2000 or month < 1 or month > 12:
+    year, month = _form_competence()
+    if not _valid_competence(year, month):
         flash("Competência inválida.", "warning")
         return redirect(url_for("payroll.close_home"))
 
@@ -3968,8 +4778,7 @@ def close_reopen():
 @payroll_bp.post("/close/upload")
 @login_required
 def close_upload():
-    year = int(request.form.get("year") or 0)
-    month = int(request.form.get("month") or 0)
+    year, month = _form_competence()
     doc_type = (request.form.get("doc_type") or "").strip().lower()
 
     if _competence_is_closed(year, month):
@@ -3978,11 +4787,11 @@ def close_upload():
             "warning",
         )
 
-    if year < 2000 or month < 1 or month > 12:
+    if not _valid_competence(year, month):
         flash("Competência inválida.", "warning")
         return redirect(url_for("payroll.close_home"))
 
-    if doc_type not in ("darf", "das", "fgts"):
+    if doc_type not in _VALID_GUIDE_DOC_TYPES:
         flash("Tipo de guia inválido.", "warning")
         return redirect(url_for("payroll.close_home", year=year, month=month))
 
@@ -4002,13 +4811,13 @@ def close_upload():
     if f and f.filename:
         fname = secure_filename(f.filename)
         ext = os.path.splitext(fname)[1].lower()
-        if ext != ".pdf":
+        if ext != ".pdf" or not _is_pdf_upload(f):
             flash("Apenas PDF.", "warning")
             return redirect(url_for("payroll.close_home", year=year, month=month))
 
         target_name = f"{year}-{month:02d}_{doc_type}.pdf"
         target_path = os.path.join(_media_guides_dir(), target_name)
-        f.save(target_path)
+        _save_upload_atomically(f, target_path)
         doc.filename = target_name
     doc.amount = amount if amount > 0 else None
     doc.due_date = due_date
@@ -8,6 +8,7 @@ import requests
 from bs4 import BeautifulSoup
 import pdfplumber
 from flask import Flask
+from sqlalchemy import func
 
 from .extensions import db
 from .models import (
@@ -406,6 +407,23 @@ def run_tax_sync(target_year: int, apply_changes: bool = False) -> dict:
     }
 
 
+def _tax_tables_status(effective_from: date) -> tuple[int, int, bool]:
+    """(faixas INSS, faixas IRRF, config IRRF presente) da vigência, num único SELECT com COUNT/EXISTS."""
+    inss_count = (
+        db.session.query(func.count(TaxInssBracket.id))
+        .filter(TaxInssBracket.effective_from == effective_from)
+        .scalar_subquery()
+    )
+    irrf_count = (
+        db.session.query(func.count(TaxIrrfBracket.id))
+        .filter(TaxIrrfBracket.effective_from == effective_from)
+        .scalar_subquery()
+    )
+    has_cfg = db.session.query(TaxIrrfConfig.id).filter(TaxIrrfConfig.effective_from == effective_from).exists()
+    inss, irrf, cfg = db.session.query(inss_count, irrf_count, has_cfg).one()
+    return int(inss or 0), int(irrf or 0), bool(cfg)
+
+
 def run_compliance_check(target_year: int, apply_tax_sync: bool = False) -> dict:
     """Run compliance checks and optionally auto-apply fiscal table sync."""
     if target_year < 2000 or target_year > 9999:
@@ -416,11 +434,9 @@ def run_compliance_check(target_year: int, apply_tax_sync: bool = False) -> dict
 
     # 1) Tabelas fiscais oficiais (INSS/IRRF)
     expected_eff = date(int(target_year), 1, 1)
-    db_inss_count = TaxInssBracket.query.filter_by(effective_from=expected_eff).count()
-    db_irrf_count = TaxIrrfBracket.query.filter_by(effective_from=expected_eff).count()
-    db_irrf_cfg = TaxIrrfConfig.query.filter_by(effective_from=expected_eff).first()
+    db_inss_count, db_irrf_count, db_irrf_cfg = _tax_tables_status(expected_eff)
 
-    need_tax_sync = db_inss_count < 3 or db_irrf_count < 3 or db_irrf_cfg is None
+    need_tax_sync = db_inss_count < 3 or db_irrf_count < 3 or not db_irrf_cfg
     sync_report_lines: list[str] = []
     if need_tax_sync:
         if apply_tax_sync:
@@ -429,10 +445,8 @@ def run_compliance_check(target_year: int, apply_tax_sync: bool = False) -> dict
             sync_report_lines = list(sync_result.get("report_lines") or [])
 
             # Re-check after applying
-            db_inss_count = TaxInssBracket.query.filter_by(effective_from=expected_eff).count()
-            db_irrf_count = TaxIrrfBracket.query.filter_by(effective_from=expected_eff).count()
-            db_irrf_cfg = TaxIrrfConfig.query.filter_by(effective_from=expected_eff).first()
-            if db_inss_count >= 3 and db_irrf_count >= 3 and db_irrf_cfg is not None:
+            db_inss_count, db_irrf_count, db_irrf_cfg = _tax_tables_status(expected_eff)
+            if db_inss_count >= 3 and db_irrf_count >= 3 and db_irrf_cfg:
                 infos.append("sync-taxes aplicado automaticamente e tabelas atualizadas.")
             else:
                 issues.append(
@@ -493,9 +507,9 @@ def run_compliance_check(target_year: int, apply_tax_sync: bool = False) -> dict
                     f"Rescisão por acordo sem aviso prévio definido (termination_id={t.id})."
                 )
 
-        fgts_balance = Decimal(str(t.fgts_balance_est or 0))
-        fgts_rate = Decimal(str(t.fgts_fine_rate or 0))
-        fgts_fine = Decimal(str(t.fgts_fine_est or 0))
+        fgts_balance = Decimal(t.fgts_balance_est or 0)
+        fgts_rate = Decimal(t.fgts_fine_rate or 0)
+        fgts_fine = Decimal(t.fgts_fine_est or 0)
         if expected_fgts_rate > 0 and fgts_balance > 0:
             if fgts_rate <= 0:
                 issues.append(
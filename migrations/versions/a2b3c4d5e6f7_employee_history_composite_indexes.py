@@ -0,0 +1,43 @@
+"""add composite per-employee indexes to thirteenth/termination/leave
+
+Revision ID: a2b3c4d5e6f7
+Revises: f1a2b3c4d5e6
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a2b3c4d5e6f7"
+down_revision = "f1a2b3c4d5e6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("employee_thirteenth", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_employee_thirteenth_employee_ref_payment",
+            ["employee_id", "reference_year", "payment_year", "payment_month"],
+            unique=False,
+        )
+
+    with op.batch_alter_table("employee_termination", schema=None) as batch_op:
+        batch_op.create_index("ix_employee_termination_employee_date", ["employee_id", "termination_date"], unique=False)
+
+    with op.batch_alter_table("employee_leave", schema=None) as batch_op:
+        batch_op.create_index("ix_employee_leave_employee_start", ["employee_id", "start_date"], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table("employee_leave", schema=None) as batch_op:
+        batch_op.drop_index("ix_employee_leave_employee_start")
+
+    with op.batch_alter_table("employee_termination", schema=None) as batch_op:
+        batch_op.drop_index("ix_employee_termination_employee_date")
+
+    with op.batch_alter_table("employee_thirteenth", schema=None) as batch_op:
+        batch_op.drop_index("ix_employee_thirteenth_employee_ref_payment")
@@ -0,0 +1,29 @@
+"""index revenue notes by competence and issue date
+
+Revision ID: b3c4d5e6f7a8
+Revises: a2b3c4d5e6f7
+Create Date: 2026-10-16 13:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b3c4d5e6f7a8"
+down_revision = "a2b3c4d5e6f7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("revenue_note", schema=None) as batch_op:
+        batch_op.create_index("ix_revenue_note_year_month_issued", ["year", "month", "issued_at"], unique=False)
+        batch_op.drop_index("ix_revenue_note_year_month")
+
+
+def downgrade():
+    with op.batch_alter_table("revenue_note", schema=None) as batch_op:
+        batch_op.create_index("ix_revenue_note_year_month", ["year", "month"], unique=False)
+        batch_op.drop_index("ix_revenue_note_year_month_issued")
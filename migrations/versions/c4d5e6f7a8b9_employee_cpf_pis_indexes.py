@@ -0,0 +1,29 @@
+"""index employee cpf and pis
+
+Revision ID: c4d5e6f7a8b9
+Revises: b3c4d5e6f7a8
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c4d5e6f7a8b9"
+down_revision = "b3c4d5e6f7a8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("employee", schema=None) as batch_op:
+        batch_op.create_index("ix_employee_cpf", ["cpf"], unique=False)
+        batch_op.create_index("ix_employee_pis", ["pis"], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table("employee", schema=None) as batch_op:
+        batch_op.drop_index("ix_employee_pis")
+        batch_op.drop_index("ix_employee_cpf")
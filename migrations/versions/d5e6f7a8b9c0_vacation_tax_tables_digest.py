@@ -0,0 +1,27 @@
+"""add tax tables digest to employee_vacation
+
+Revision ID: d5e6f7a8b9c0
+Revises: c4d5e6f7a8b9
+Create Date: 2026-10-16 15:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d5e6f7a8b9c0"
+down_revision = "c4d5e6f7a8b9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("employee_vacation", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("tax_tables_digest", sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("employee_vacation", schema=None) as batch_op:
+        batch_op.drop_column("tax_tables_digest")
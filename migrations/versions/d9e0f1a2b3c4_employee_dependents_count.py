@@ -0,0 +1,36 @@
+"""add dependents_count to employee
+
+Revision ID: d9e0f1a2b3c4
+Revises: c8d4e5f6a7b8
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d9e0f1a2b3c4"
+down_revision = "c8d4e5f6a7b8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("employee", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("dependents_count", sa.Integer(), nullable=False, server_default="0"))
+
+    op.execute(
+        "UPDATE employee SET dependents_count = ("
+        "SELECT COUNT(*) FROM employee_dependent WHERE employee_dependent.employee_id = employee.id"
+        ")"
+    )
+
+    with op.batch_alter_table("employee", schema=None) as batch_op:
+        batch_op.alter_column("dependents_count", server_default=None)
+
+
+def downgrade():
+    with op.batch_alter_table("employee", schema=None) as batch_op:
+        batch_op.drop_column("dependents_count")
@@ -0,0 +1,29 @@
+"""add tax table snapshot dates to employee_vacation
+
+Revision ID: e0f1a2b3c4d5
+Revises: d9e0f1a2b3c4
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e0f1a2b3c4d5"
+down_revision = "d9e0f1a2b3c4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("employee_vacation", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("inss_table_from", sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column("irrf_table_from", sa.Date(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("employee_vacation", schema=None) as batch_op:
+        batch_op.drop_column("irrf_table_from")
+        batch_op.drop_column("inss_table_from")
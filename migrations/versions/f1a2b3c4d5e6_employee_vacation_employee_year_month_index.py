@@ -0,0 +1,27 @@
+"""add composite (employee_id, year, month) index to employee_vacation
+
+Revision ID: f1a2b3c4d5e6
+Revises: e0f1a2b3c4d5
+Create Date: 2026-10-16 11:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f1a2b3c4d5e6"
+down_revision = "e0f1a2b3c4d5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("employee_vacation", schema=None) as batch_op:
+        batch_op.create_index("ix_employee_vacation_employee_year_month", ["employee_id", "year", "month"], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table("employee_vacation", schema=None) as batch_op:
+        batch_op.drop_index("ix_employee_vacation_employee_year_month")
@@ -38,7 +38,7 @@ def _request(
     body = None
     hdrs = headers or {}
     if data is not None:
-        body = urllib.parse.urlencode(data).encode("utf-8")
+        body = urllib.parse.urlencode(data, doseq=True).encode("utf-8")
         hdrs.setdefault("Content-Type", "application/x-www-form-urlencoded")
     req = urllib.request.Request(url, data=body, method=method.upper(), headers=hdrs)
     try:
@@ -428,6 +428,52 @@ def main() -> int:
     if "1/3 constitucional" not in rec_page:
         raise RuntimeError("Vacation receipt missing 1/3 constitucional line")
 
+    print("[7.3.1] Validate yearly vacation receipts page")
+    bulk_page = _request(
+        opener,
+        "GET",
+        f"/payroll/employees/{deise_id}/vacations/receipts?year={test_year}",
+    ).read().decode("utf-8", errors="replace")
+    if "Recibos de férias" not in bulk_page:
+        raise RuntimeError("Yearly vacation receipts page title not found")
+    if "1/3 constitucional" not in bulk_page:
+        raise RuntimeError("Yearly vacation receipts page missing receipt body")
+
+    print("[7.3.2] Recalculate vacation estimates and validate receipt")
+    recalc_page = _request(opener, "POST", f"/payroll/vacations/{vac_id}/recalc").read().decode("utf-8", errors="replace")
+    if "Estimativas de INSS/IRRF" not in recalc_page:
+        raise RuntimeError("Vacation recalc flash message not found")
+    if "Recibo de férias" not in recalc_page or "Deise" not in recalc_page:
+        raise RuntimeError("Vacation recalc did not redirect back to the receipt")
+
+    print("[7.3.3] Register collective vacations for both employees")
+    # Next year's competence keeps the single-vacation count checked in [7.4] intact.
+    bulk_year = test_year + 1
+    bulk_vac_page = _request(
+        opener,
+        "POST",
+        "/payroll/vacations/bulk",
+        {
+            "year": str(bulk_year),
+            "month": str(test_month),
+            "start_date": f"{bulk_year}-{test_month:02d}-10",
+            "pay_date": f"{bulk_year}-{test_month:02d}-08",
+            "days": "10",
+            "sell_days": "0",
+            "employee_ids": [str(deise_id), str(juvenaldo_id)],
+        },
+    ).read().decode("utf-8", errors="replace")
+    if "Férias coletivas registradas para 2 funcionário(s)." not in bulk_vac_page:
+        raise RuntimeError("Collective vacations flash message not found")
+    for eid in (deise_id, juvenaldo_id):
+        emp_receipts_page = _request(
+            opener,
+            "GET",
+            f"/payroll/employees/{eid}/vacations/receipts?year={bulk_year}",
+        ).read().decode("utf-8", errors="replace")
+        if "1/3 constitucional" not in emp_receipts_page:
+            raise RuntimeError(f"Collective vacation row not found for employee {eid}")
+
     print("[7.4] Validate vacations appear in closing summary")
     close_page_vac = _request(
         opener,